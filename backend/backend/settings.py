@@ -81,6 +81,30 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = BASE_DIR / 'public/'
 MEDIA_URL = '/public/'
 
+# Location of uploaded datasets, stored as feather files and referenced by their id
+DATASET_ROOT = BASE_DIR / 'datasets/'
+
+# csv and xlsx uploads larger than this (bytes) are ingested in chunks with bounded memory
+INGEST_STREAMING_THRESHOLD = 64 * 1024 * 1024
+
+# worker processes parsing the files of a batch upload, None uses one per CPU
+BATCH_INGEST_WORKERS = None
+
+# worker processes drawing the permutations of the transition permutation test, None uses one per CPU
+PERMUTATION_WORKERS = None
+
+# graphviz processes rendering networks at the same time, None uses one per CPU
+RENDER_WORKERS = None
+
+# seconds a request waits for its network to be rendered
+RENDER_TIMEOUT = 60
+
+# Store event times as float32 instead of float64, saves memory but limits the precision for long recordings
+DATASET_FLOAT32_TIME = False
+
+# Memory budget (bytes) of the in-process cache for parsed datasets
+DATASET_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 # CORS
 CORS_ALLOWED_ORIGINS = ["http://127.0.0.1:3000"]
 CORS_ORIGIN_ALLOW_ALL = True
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import uuid
+
+# Saved images, graphs and statistics are named after a hash of the dataset, the view and the request parameters,
+# so a repeated request is answered with the files of the first one instead of computing them again.
+# Files are written under a temporary name and then renamed, so a concurrent request never finds a half written file.
+
+# django localhost to save images
+localhost = "http://127.0.0.1:8000/"
+
+
+def request_params(data):
+    """
+    Normalizes the parameters of a request, json encoded values are decoded so e.g. "[1,2]" and "[1, 2]" are the same.
+    The dataset itself is identified separately.
+
+    :param data: request data
+    :return: dict {parameter: value}
+    """
+    params = {}
+    for key, value in data.items():
+        if key in ["dataset", "upload"]:
+            continue
+        try:
+            params[key] = json.loads(value)
+        except (TypeError, ValueError):
+            params[key] = value
+    return params
+
+
+def artifact_path(directory, prefix, dataset_id, view, params):
+    """
+    Derives the location of the files of a view from the dataset and the parameters it is requested with.
+
+    :param directory: subdirectory of public
+    :param prefix: prefix of the file name
+    :param dataset_id: id of the dataset, None if the view does not depend on one
+    :param view: name of the view
+    :param params: normalized request parameters, see request_params
+    :return: path without extension
+    """
+    key = json.dumps([dataset_id, view, params], sort_keys=True, default=str)
+    return "public/{}/{}-{}".format(directory, prefix, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def existing_url(location, marker=None):
+    """
+    Looks up a file saved by an earlier request.
+
+    :param location: path of the file the url points to
+    :param marker: path of the file that is saved last, defaults to location
+    :return: url of location or None if the files do not exist (yet)
+    """
+    if os.path.exists(marker or location):
+        return localhost + location
+    return None
+
+
+def temporary_path(path):
+    """
+    :param path: destination of a file
+    :return: unique temporary name in the same directory, to be renamed to path with os.replace
+    """
+    return path + "." + uuid.uuid4().hex + ".tmp"
+
+
+def save_figure(fig, path):
+    """
+    Saves a matplotlib figure as svg image.
+
+    :param fig: matplotlib figure
+    :param path: destination
+    """
+    tmp_path = temporary_path(path)
+    fig.savefig(tmp_path, format="svg", bbox_inches="tight")
+    os.replace(tmp_path, path)
+
+
+def save_json(data, path):
+    """
+    :param data: json serializable data
+    :param path: destination
+    """
+    tmp_path = temporary_path(path)
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
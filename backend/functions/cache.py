@@ -0,0 +1,134 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+# default memory budget for cached datasets (256 MB), can be overridden with DATASET_CACHE_MAX_BYTES in settings.py
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def hash_upload(raw_data):
+    """
+    Computes a content hash of an upload, so identical files map to the same cache entry.
+
+    :param raw_data: uploaded file or name of an example dataset
+    :return: hex digest of the content
+    """
+    sha = hashlib.sha256()
+    if isinstance(raw_data, str):
+        sha.update(raw_data.encode("utf-8"))
+        return sha.hexdigest()
+
+    # django uploads may live on disk, so hash them blockwise
+    raw_data.seek(0)
+    for block in iter(lambda: raw_data.read(1024 * 1024), b""):
+        sha.update(block)
+    raw_data.seek(0)
+    return sha.hexdigest()
+
+
+def get_size(value):
+    """
+    Estimates the memory footprint of a cached value in bytes.
+
+    :param value: dataframe, numpy array or container of those
+    :return: size in bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_size(x) for x in value)
+    if isinstance(value, dict):
+        return sum(get_size(x) for x in value.values())
+    return sys.getsizeof(value)
+
+
+class DatasetCache:
+    """
+    Thread-safe least recently used cache for parsed datasets.
+    Entries are evicted once the summed size of all entries exceeds the memory budget.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def budget(self):
+        """
+        :return: memory budget in bytes, read from the django settings unless set explicitly
+        """
+        if self.max_bytes is not None:
+            return self.max_bytes
+        return getattr(settings, "DATASET_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+
+    def get(self, key):
+        """
+        Returns the cached value for key and marks it as most recently used.
+
+        :param key: cache key
+        :return: cached value or None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """
+        Stores value under key and evicts least recently used entries until the budget is met.
+        Values larger than the whole budget are not cached.
+
+        :param key: cache key
+        :param value: value to cache
+        """
+        size = get_size(value)
+        budget = self.budget()
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > budget:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: dict with hit/miss counters and current memory usage
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.budget(),
+            }
+
+
+# cache shared by all views
+dataset_cache = DatasetCache()
@@ -17,9 +17,10 @@ from scipy.spatial.distance import squareform
 from sklearn.cluster import AgglomerativeClustering
 from scipy.cluster.hierarchy import dendrogram, linkage
 
-# plotting
+# plotting, on Figure objects instead of the global pyplot state so requests can render concurrently
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from .artifacts import save_figure
 
 # django localhost to save images
 localhost = "http://127.0.0.1:8000/"
@@ -52,22 +53,20 @@ def str_to_dist(s):
 
 
 
-def distances(networks, distance_alg):
+def graph_distances(graphs, distance_alg):
     """
-    Calculates pairwise graph distances for {(a,b) | a,b \in networks}
+    Calculates pairwise graph distances for {(a,b) | a,b \in graphs}
 
-    :param networks: list of saved transition networks
+    :param graphs: dict {name: networkx graph}
     :param distance_alg: type of distance algorithm to apply
     :return: list of 3-tuples (first network, second network, distance)
     """
     distances = list()
     # get netrd.distance object from string
     dist = str_to_dist(distance_alg)
-    # take network names pairwise
-    for a, b in itertools.combinations(networks, 2):
-        # load networks as networkx objects
-        n1 = nx.read_gml("public/transitions/" + a.split("/")[-1])
-        n2 = nx.read_gml("public/transitions/" + b.split("/")[-1])
+    # take networks pairwise
+    for a, b in itertools.combinations(graphs, 2):
+        n1, n2 = graphs[a].copy(), graphs[b].copy()
         # add nodes that are only present in one graph to the other if distance algorithm requires it
         if distance_alg in ["Hamming", "Frobenius", "PolynomialDissimilarity"]:
             n1.add_nodes_from(np.setdiff1d(n2.nodes(), n1.nodes()))
@@ -79,6 +78,45 @@ def distances(networks, distance_alg):
     return distances
 
 
+def distances(networks, distance_alg):
+    """
+    Calculates pairwise graph distances for {(a,b) | a,b \in networks}
+
+    :param networks: list of saved transition networks
+    :param distance_alg: type of distance algorithm to apply
+    :return: list of 3-tuples (first network, second network, distance)
+    """
+    # load networks as networkx objects
+    graphs = {name: nx.read_gml("public/transitions/" + name.split("/")[-1]) for name in networks}
+    return graph_distances(graphs, distance_alg)
+
+
+def tensor_to_graphs(tensor, normalized=False):
+    """
+    Builds one transition network per subject from a transition tensor, see transitions.transition_tensor.
+    Edges are weighted by count or by the frequency among all outgoing transitions of a behavior.
+
+    :param tensor: dict of numpy arrays
+    :param normalized: weight edges by the frequency with which a behavior follows another
+    :return: dict {subject: networkx DiGraph}
+    """
+    # outgoing transitions per subject and behavior
+    outgoing = np.zeros((len(tensor["subjects"]), len(tensor["labels"])), dtype=np.int64)
+    np.add.at(outgoing, (tensor["subject"], tensor["row"]), tensor["count"])
+    weights = tensor["count"] / outgoing[tensor["subject"], tensor["row"]] if normalized else tensor["count"]
+
+    graphs = {}
+    for i, subject in enumerate(tensor["subjects"]):
+        G = nx.DiGraph()
+        entries = tensor["subject"] == i
+        rows, cols = tensor["row"][entries], tensor["col"][entries]
+        G.add_nodes_from(tensor["labels"][np.union1d(rows, cols)])
+        for u, v, w in zip(tensor["labels"][rows], tensor["labels"][cols], weights[entries]):
+            G.add_edge(u, v, weight=float(w) if normalized else int(w))
+        graphs[subject] = G
+    return graphs
+
+
 def edgelist_to_dist_matrix(edge_list):
     # Create a dictionary to map node names to matrix indices
     node_dict = {}
@@ -119,7 +157,7 @@ def create_graph(dist_matrix, node_dict, distance_alg, setindices):
     node_colors = [label_colors[node_labels[node]] for node in G.nodes()]
 
     # Create a 3D plot
-    fig = plt.figure()
+    fig = Figure()
     ax = fig.add_subplot(111, projection='3d')
 
     # Generate node positions using spring layout
@@ -146,38 +184,38 @@ def create_graph(dist_matrix, node_dict, distance_alg, setindices):
 
     # Set the first perspective
     ax.view_init(elev=30, azim=45)
-    plt.title(f"Front", fontsize=14, pad=20)
+    ax.set_title(f"Front", fontsize=14, pad=20)
 
     # Save and return image
     path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
+    save_figure(fig, path)
     url1 = localhost + path
 
     # Set the second perspective
     ax.view_init(elev=30, azim=80)
-    plt.title(f"Right", fontsize=14, pad=20)
+    ax.set_title(f"Right", fontsize=14, pad=20)
 
     # Save and return image
     path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
+    save_figure(fig, path)
     url2 = localhost + path
 
     # Set the third perspective
     ax.view_init(elev=80, azim=45)
-    plt.title(f"Above", fontsize=14, pad=20)
+    ax.set_title(f"Above", fontsize=14, pad=20)
 
     # Save and return image
     path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
+    save_figure(fig, path)
     url3 = localhost + path
 
-    plt.close("all")
-
     return (url1,url2,url3)
 
 
 
-def hierarchical_cluster(dist_matrix, node_dict, distance_alg, linkage_method="average", setindices=False, color_threshold=0.2):
+def hierarchical_cluster(
+    dist_matrix, node_dict, distance_alg, linkage_method="average", setindices=False, color_threshold=0.2, path=None
+):
     # Convert the distance matrix to a condensed distance matrix
     dist_condensed = squareform(dist_matrix)
 
@@ -203,31 +241,39 @@ def hierarchical_cluster(dist_matrix, node_dict, distance_alg, linkage_method="a
         
         labels = result
 
-    # get the current figure and adjust its size
-    fig = plt.gcf()
+    # new figure with adjusted size
+    fig = Figure()
     fig.set_size_inches(fig.get_size_inches() * 1.2) # scale by 20
+    ax = fig.subplots()
 
     # Plot the dendrogram of the clustering
-    plt.title(f"Dendrogram for {distance_alg} distances across transition networks", fontsize=14, pad=20)
-    plt.xlabel("Index")
-    plt.ylabel("Distance")
-    dendrogram(linkage(dist_condensed, method=linkage_method), labels=labels, truncate_mode="level", color_threshold=color_threshold)
+    ax.set_title(f"Dendrogram for {distance_alg} distances across transition networks", fontsize=14, pad=20)
+    ax.set_xlabel("Index")
+    ax.set_ylabel("Distance")
+    dendrogram(
+        linkage(dist_condensed, method=linkage_method),
+        labels=labels,
+        truncate_mode="level",
+        color_threshold=color_threshold,
+        ax=ax,
+    )
     
     # save and return image
-    path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
+    if path is None:
+        path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
+    save_figure(fig, path)
     url = localhost + path
-    plt.close("all")
 
     return url
 
 
-def mds(dist_matrix, node_dict, distance_alg, random_state=0, n_init=4, setindices=False):
+def mds(dist_matrix, node_dict, distance_alg, random_state=0, n_init=4, setindices=False, path=None):
     """
     Uses multidimensional scaling to visualize the distances provided in the edge list
 
     :edgelist: 3-tuple ()
     :param cluster_alg:
+    :param path: where the svg image is saved, a new random name if not given
     :return: image url
     """
     # prepare labels to match scatter dots and colors
@@ -265,26 +311,25 @@ def mds(dist_matrix, node_dict, distance_alg, random_state=0, n_init=4, setindic
     mds_coords = mds_model.fit_transform(dist_matrix)
 
     # init mpl figure
-    f = plt.figure()
+    fig = Figure()
+    ax = fig.subplots()
 
-    plt.scatter(mds_coords[:, 0], mds_coords[:, 1], c=color_list, alpha=0.9)
+    ax.scatter(mds_coords[:, 0], mds_coords[:, 1], c=color_list, alpha=0.9)
 
     for label, x, y in zip(labels, mds_coords[:, 0], mds_coords[:, 1]):
-        plt.annotate(label, (x, y), xycoords="data")
+        ax.annotate(label, (x, y), xycoords="data")
 
-    plt.xlabel("First Dimension")
-    plt.ylabel("Second Dimension")
-    plt.title(f"MDS embedding of {distance_alg} distances across transition networks", fontsize=14, pad=20)
+    ax.set_xlabel("First Dimension")
+    ax.set_ylabel("Second Dimension")
+    ax.set_title(f"MDS embedding of {distance_alg} distances across transition networks", fontsize=14, pad=20)
 
-    # get the current figure and adjust its size
-    fig = plt.gcf()
+    # adjust the figure size
     fig.set_size_inches(fig.get_size_inches() * 1.2) # scale by 20
 
     # save and return image
-    path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
+    if path is None:
+        path = "public/comparisons/comparisons-" + uuid.uuid4().hex + ".svg"
+    save_figure(fig, path)
     url = localhost + path
 
-    plt.close("all")
-
     return (url,labels)
\ No newline at end of file
@@ -0,0 +1,523 @@
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import feather
+from django.conf import settings
+from .cache import dataset_cache, hash_upload
+from .helpers import map_values_to_color
+from .ingest import (
+    BOUT_COLUMNS,
+    CATEGORICAL_COLUMNS,
+    EXAMPLE_DATA,
+    IngestResult,
+    build_bouts,
+    detect_file_type,
+    ingest,
+    ingest_bytes,
+    iter_ingest,
+    merge_sessions,
+)
+from .permutations import DEFAULT_SEED
+from .transitions import count_subject_transitions
+from .visualizations import transition_tables
+
+# uploads larger than this (bytes) are ingested in chunks, can be overridden with INGEST_STREAMING_THRESHOLD in settings.py
+DEFAULT_STREAMING_THRESHOLD = 64 * 1024 * 1024
+
+# dataset ids are sha256 hex digests of the uploaded content
+DATASET_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# parsed example datasets kept in memory, {name: (file signature, dataset id, dataframe)}
+example_datasets = {}
+
+
+def dataset_path(dataset_id, table=None):
+    """
+    Returns the location of a stored dataset or of a table derived from it.
+
+    :param dataset_id: id returned by the upload
+    :param table: name of a derived table, e.g. "bouts", None for the events
+    :return: path of the feather file or None if the id is malformed
+    """
+    if not isinstance(dataset_id, str) or not DATASET_ID_PATTERN.match(dataset_id):
+        return None
+    name = dataset_id + ("." + table if table else "") + ".feather"
+    return os.path.join(settings.DATASET_ROOT, name)
+
+
+def to_feather_compatible(df):
+    """
+    Prepares a cleaned dataframe for the columnar store. Arrow needs a default index and
+    columns of a single type, so object columns mixing e.g. numbers and text are stored as text.
+
+    :param df: pandas dataframe
+    :return: pandas dataframe that can be written with feather
+    """
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        elif df[col].dtype == "category" and pd.api.types.infer_dtype(df[col].cat.categories).startswith("mixed"):
+            # e.g. total_length merged from a text and a numeric session
+            df[col] = df[col].astype(object)
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype("category")
+    return df
+
+
+def write_table(path, data):
+    """
+    Writes a dataframe or arrow table as uncompressed feather file.
+
+    :param path: destination
+    :param data: pandas dataframe or pyarrow table
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so concurrent readers never see half written data
+    tmp_path = path + "." + uuid.uuid4().hex + ".tmp"
+    feather.write_feather(data, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def store_dataset(dataset_id, df):
+    """
+    Saves a cleaned dataset and its bout table in the columnar store so later requests can refer to it by id.
+
+    :param dataset_id: id of the dataset
+    :param df: cleaned pandas dataframe
+    """
+    df = to_feather_compatible(df)
+    # derived tables first, a dataset counts as stored once its events exist
+    write_table(dataset_path(dataset_id, "bouts"), build_bouts(df))
+    write_table(dataset_path(dataset_id), df)
+
+
+def compact_table(table, float32_time=False):
+    """
+    Arrow counterpart of ingest.compact: dictionary encodes label columns and repetitive text columns,
+    which pandas reads back as categoricals.
+
+    :param table: pyarrow table with text columns
+    :param float32_time: store time as float32
+    :return: pyarrow table
+    """
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        if not pa.types.is_string(column.type):
+            continue
+        if name in CATEGORICAL_COLUMNS or pc.count_distinct(column).as_py() <= len(table) // 2:
+            table = table.set_column(i, name, column.dictionary_encode())
+    if float32_time:
+        i = table.column_names.index("time")
+        table = table.set_column(i, "time", table.column(i).cast(pa.float32()))
+    # chunks were encoded separately, the file format needs one dictionary per column
+    return table.unify_dictionaries()
+
+
+def store_dataset_chunks(dataset_id, chunks, errors, float32_time=False):
+    """
+    Writes cleaned chunks straight to the columnar store, so only one chunk of the parsed text is held in memory.
+    A second pass over the memory-mapped file compacts the label columns. Memory is bounded by the compacted
+    table, which holds the label columns dictionary encoded, and the bout table built from it. Bouts are not
+    built per chunk, since a START and its STOP may be in different chunks.
+
+    :param dataset_id: id of the dataset
+    :param chunks: iterable of cleaned pandas dataframes, see ingest.iter_ingest
+    :param errors: validation errors collected while chunks are produced, the dataset is only stored if it stays empty
+    :param float32_time: store time as float32
+    """
+    path = dataset_path(dataset_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    raw_path = path + "." + uuid.uuid4().hex + ".raw"
+    writer = None
+    last_time = None
+    try:
+        with pa.OSFile(raw_path, "wb") as sink:
+            for chunk in chunks:
+                if writer is None:
+                    # cells are text apart from time, so every chunk shares the schema of the first
+                    schema = pa.schema([(col, pa.float64() if col == "time" else pa.string()) for col in chunk.columns])
+                    writer = pa.ipc.new_file(sink, schema)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                if len(chunk):
+                    last_time = chunk.time.iloc[-1]
+            if writer is not None:
+                writer.close()
+        if errors or writer is None:
+            return
+
+        table = feather.read_table(raw_path, memory_map=True)
+        if "total_length" not in table.column_names:
+            table = table.append_column("total_length", pa.array(np.full(len(table), last_time)))
+        table = compact_table(table, float32_time)
+        # the bout table only needs the label, status and time columns
+        columns = [col for col in BOUT_COLUMNS + ["status", "time", "session"] if col in table.column_names]
+        write_table(dataset_path(dataset_id, "bouts"), build_bouts(table.select(columns).to_pandas()))
+        write_table(path, table)
+    finally:
+        os.remove(raw_path)
+
+
+def read_dataset(dataset_id):
+    """
+    Loads a stored dataset, from memory if possible or else memory-mapped from disk.
+
+    :param dataset_id: id returned by the upload
+    :return: pandas dataframe or None if the dataset does not exist
+    """
+    df = dataset_cache.get(dataset_id)
+    if df is None:
+        path = dataset_path(dataset_id)
+        if path is None or not os.path.exists(path):
+            return None
+        # uncompressed feather files are mapped instead of read, numeric columns are not copied
+        df = feather.read_table(path, memory_map=True).to_pandas()
+        dataset_cache.put(dataset_id, df)
+    # views only add or replace columns, so a shallow copy keeps the cached frame intact without copying its data
+    return df.copy(deep=False)
+
+
+def read_bouts(dataset_id):
+    """
+    Loads the bout table of a stored dataset, see ingest.build_bouts.
+    It is built from the events for datasets stored without one.
+
+    :param dataset_id: id returned by the upload
+    :return: pandas dataframe or None if the dataset does not exist
+    """
+    # malformed or missing ids have no path
+    path = dataset_path(dataset_id, "bouts")
+    if path is None:
+        return None
+    key = dataset_id + ".bouts"
+    bouts = dataset_cache.get(key)
+    if bouts is None:
+        if os.path.exists(path):
+            bouts = feather.read_table(path, memory_map=True).to_pandas()
+        else:
+            df = read_dataset(dataset_id)
+            if df is None:
+                return None
+            bouts = build_bouts(df)
+            write_table(path, bouts)
+        dataset_cache.put(key, bouts)
+    return bouts.copy(deep=False)
+
+
+def read_transition_counts(dataset_id, option):
+    """
+    Loads the per subject transition counts of a stored dataset, see transitions.count_subject_transitions.
+    They are counted on first use and stored next to the dataset.
+
+    :param dataset_id: id returned by the upload
+    :param option: behavior or behavioral_category
+    :return: pandas dataframe or None if the dataset does not exist
+    """
+    # malformed or missing ids have no path
+    path = dataset_path(dataset_id, "transitions-" + option)
+    if path is None:
+        return None
+    key = dataset_id + ".transitions." + option
+    counts = dataset_cache.get(key)
+    if counts is None:
+        if os.path.exists(path):
+            counts = feather.read_table(path, memory_map=True).to_pandas()
+        else:
+            df = read_dataset(dataset_id)
+            if df is None:
+                return None
+            counts = count_subject_transitions(df, option)
+            write_table(path, counts)
+        dataset_cache.put(key, counts)
+    return counts.copy(deep=False)
+
+
+def is_large_upload(raw_data):
+    """
+    :param raw_data: arbitrary file
+    :return: True if raw_data is a csv or xlsx file that should be ingested in chunks
+    """
+    size = os.path.getsize(raw_data) if isinstance(raw_data, str) else raw_data.size
+    if size <= getattr(settings, "INGEST_STREAMING_THRESHOLD", DEFAULT_STREAMING_THRESHOLD):
+        return False
+    return detect_file_type(raw_data) != "xls"
+
+
+def example_signature(name):
+    """
+    :param name: name of an example dataset
+    :return: 2-tuple (modification time in ns, size) of its xlsx file
+    """
+    stat = os.stat(EXAMPLE_DATA[name])
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_example(name):
+    """
+    Loads an example dataset from memory. The xlsx file is only parsed on first use and whenever it changes on disk,
+    otherwise the dataset stored from an earlier run is read.
+
+    :param name: name of an example dataset
+    :return: 2-tuple (dataset id, IngestResult)
+    """
+    signature = example_signature(name)
+    entry = example_datasets.get(name)
+    if entry is None or entry[0] != signature:
+        # the id depends on the file signature, so an edited file never maps to the stale dataset
+        dataset_id = hash_upload("{}:{}:{}".format(name, *signature))
+        df = read_dataset(dataset_id)
+        if df is None:
+            result = ingest(name, getattr(settings, "DATASET_FLOAT32_TIME", False))
+            if result.errors:
+                return dataset_id, result
+            store_dataset(dataset_id, result.df)
+            df = read_dataset(dataset_id)
+        entry = (signature, dataset_id, df)
+        example_datasets[name] = entry
+    return entry[1], IngestResult(entry[2].copy(deep=False), [])
+
+
+def ingest_upload(raw_data):
+    """
+    Ingests and stores an upload, parsing it only if no identical file has been stored before.
+    Datasets that are already stored or streamed to the store are not loaded, their IngestResult
+    has no dataframe and they can be loaded with read_dataset.
+
+    :param raw_data: arbitrary file
+    :return: 2-tuple (dataset id, IngestResult), invalid data is not stored
+    """
+    if isinstance(raw_data, str) and raw_data in EXAMPLE_DATA:
+        return load_example(raw_data)
+
+    dataset_id = hash_upload(raw_data)
+    if os.path.exists(dataset_path(dataset_id)):
+        return dataset_id, IngestResult(None, [])
+
+    float32_time = getattr(settings, "DATASET_FLOAT32_TIME", False)
+    if is_large_upload(raw_data):
+        errors = []
+        store_dataset_chunks(dataset_id, iter_ingest(raw_data, errors), errors, float32_time)
+        # the dataset may not fit into memory, so it is not read back
+        return dataset_id, IngestResult(None, errors)
+
+    result = ingest(raw_data, float32_time)
+    if result.errors:
+        return dataset_id, result
+    store_dataset(dataset_id, result.df)
+    # read back so every request sees the dataset exactly as stored
+    return dataset_id, IngestResult(read_dataset(dataset_id), [])
+
+
+def session_names(uploads):
+    """
+    Names the sessions of a batch upload after their files, numbering repeated file names.
+
+    :param uploads: list of uploaded files
+    :return: list of unique session names
+    """
+    names = []
+    for upload in uploads:
+        name = os.path.splitext(os.path.basename(upload.name))[0]
+        unique_name, i = name, 2
+        while unique_name in names:
+            unique_name = "{} ({})".format(name, i)
+            i += 1
+        names.append(unique_name)
+    return names
+
+
+def ingest_batch(uploads):
+    """
+    Ingests several uploads, one per recording session, in parallel and stores them as one dataset with column session.
+
+    :param uploads: list of uploaded files
+    :return: 2-tuple (dataset id, IngestResult), nothing is stored if any file is invalid
+    """
+    # the session column is named after the files, so identical files under other names are another dataset
+    sessions = session_names(uploads)
+    dataset_id = hash_upload(
+        "batch:" + json.dumps([[name, hash_upload(upload)] for name, upload in zip(sessions, uploads)])
+    )
+    df = read_dataset(dataset_id)
+    if df is not None:
+        return dataset_id, IngestResult(df, [])
+
+    float32_time = getattr(settings, "DATASET_FLOAT32_TIME", False)
+    names = [upload.name for upload in uploads]
+    contents = [upload.read() for upload in uploads]
+    if len(uploads) == 1:
+        results = [ingest_bytes(names[0], contents[0], float32_time)]
+    else:
+        workers = min(len(uploads), getattr(settings, "BATCH_INGEST_WORKERS", None) or os.cpu_count())
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(ingest_bytes, names, contents, repeat(float32_time)))
+
+    # prefix messages with the file name, so format_errors keeps the files apart
+    errors = [
+        dict(error, file=name, message="{}: {}".format(name, error["message"]))
+        for name, result in zip(names, results)
+        for error in result.errors
+    ]
+    if errors:
+        return dataset_id, IngestResult(None, errors)
+
+    store_dataset(dataset_id, merge_sessions(zip(sessions, [result.df for result in results])))
+    return dataset_id, IngestResult(read_dataset(dataset_id), [])
+
+
+def filter_sessions(df, data):
+    """
+    Restricts a dataset of a batch upload to the sessions selected with the request parameter session_list.
+
+    :param df: events or bouts
+    :param data: request data
+    :return: pandas dataframe
+    """
+    if "session_list" not in data or "session" not in df.columns:
+        return df
+    session_list = json.loads(data["session_list"])
+    if "dummy" in session_list:
+        return df
+    return df[df.session.isin(session_list)].reset_index(drop=True)
+
+
+def dataset_from_request(data):
+    """
+    Resolves the dataset a request refers to, either by id or by a (legacy) file upload.
+    The optional parameter session_list selects sessions of a batch upload.
+
+    :param data: request data
+    :return: 2-tuple (dataset id, pandas dataframe), both None if the dataset is unknown
+    """
+    if "dataset" in data:
+        dataset_id, df = data["dataset"], read_dataset(data["dataset"])
+        if df is None:
+            return None, None
+    elif "upload" not in data:
+        return None, None
+    else:
+        dataset_id, result = ingest_upload(data["upload"])
+        if result.errors:
+            return None, None
+        df = result.df if result.df is not None else read_dataset(dataset_id)
+
+    return dataset_id, filter_sessions(df, data)
+
+
+def dataset_id_from_request(data):
+    """
+    Resolves the id of the dataset a request refers to without loading the dataset,
+    e.g. for views that answer from cached results.
+
+    :param data: request data
+    :return: dataset id or None if the dataset is unknown
+    """
+    if "dataset" in data:
+        path = dataset_path(data["dataset"])
+        return data["dataset"] if path is not None and os.path.exists(path) else None
+    if "upload" not in data:
+        return None
+    dataset_id, result = ingest_upload(data["upload"])
+    return None if result.errors else dataset_id
+
+
+def events_from_request(dataset_id, data):
+    """
+    Loads the events of the dataset a request refers to, for views that check for saved results first.
+
+    :param dataset_id: id returned by dataset_id_from_request
+    :param data: request data
+    :return: pandas dataframe or None if the dataset does not exist
+    """
+    df = read_dataset(dataset_id)
+    return None if df is None else filter_sessions(df, data)
+
+
+def bouts_from_request(dataset_id, data):
+    """
+    Loads the bout table of the dataset a request refers to.
+
+    :param dataset_id: id returned by dataset_from_request
+    :param data: request data
+    :return: pandas dataframe
+    """
+    return filter_sessions(read_bouts(dataset_id), data)
+
+
+def transition_counts_from_request(dataset_id, data, option):
+    """
+    Loads the per subject transition counts of the dataset a request refers to.
+
+    :param dataset_id: id returned by dataset_from_request
+    :param data: request data
+    :param option: behavior or behavioral_category
+    :return: pandas dataframe or None if the dataset does not exist
+    """
+    counts = read_transition_counts(dataset_id, option)
+    if counts is None:
+        return None
+    return filter_sessions(counts, data)
+
+
+def transition_tables_from_request(
+    dataset_id,
+    data,
+    option,
+    min_edge_count,
+    normalized,
+    id_list,
+    bhvr_list,
+    order=1,
+    normalization_mode="row",
+    permutations=0,
+    random_state=DEFAULT_SEED,
+):
+    """
+    Counts the edge and node tables of a transition network, see visualizations.transition_tables.
+    They are cached per dataset and counting parameters together with the colors of the behavioral categories,
+    so requests that only change the appearance of a network reuse them without loading the dataset.
+
+    :param dataset_id: id returned by dataset_id_from_request
+    :param data: request data
+    :return: 3-tuple (edges_df, nodes_df, category colors) or None if the dataset does not exist
+    """
+    params = [
+        json.loads(data.get("session_list", '["dummy"]')),
+        option,
+        min_edge_count,
+        normalized,
+        sorted(map(str, id_list)),
+        sorted(map(str, bhvr_list)),
+        json.loads(data.get("with_status", "false")),
+        order,
+        normalization_mode,
+        permutations,
+        random_state,
+    ]
+    if dataset_id is None:
+        return None
+    key = dataset_id + ".transition-tables." + hash_upload(json.dumps(params))
+    # unseeded permutation tests are random, so they are not cached
+    cacheable = not (permutations and random_state is None)
+    tables = dataset_cache.get(key) if cacheable else None
+    if tables is None:
+        df = read_dataset(dataset_id)
+        if df is None:
+            return None
+        df = filter_sessions(df, data)
+        bouts = bouts_from_request(dataset_id, data)
+        # colors of all categories, so a category keeps its color whichever behaviors are selected
+        category_colors = map_values_to_color(df, True)
+        tables = transition_tables(
+            df, option, min_edge_count, normalized, id_list, bhvr_list, bouts, order, normalization_mode,
+            permutations, random_state,
+        ) + (category_colors,)
+        if cacheable:
+            dataset_cache.put(key, tables)
+    return tables[0].copy(), tables[1].copy(), dict(tables[2])
@@ -0,0 +1,78 @@
+import hashlib
+import networkx as nx
+import pandas as pd
+from .cache import DatasetCache
+
+# Node statistics of rendered networks. Each centrality is computed once per graph and only if it is
+# requested, results are memoized by a fingerprint of the graph structure.
+
+# centralities by the name used in the node mappings, with the column name of the statistics table
+CENTRALITIES = {
+    "indeg": ("In-Deg.Cen.", nx.in_degree_centrality),
+    "outdeg": ("Out-Deg.Cen.", nx.out_degree_centrality),
+    "closeness": ("Closen.Cen.", nx.closeness_centrality),
+    "betweenness": ("Between.Cen.", nx.betweenness_centrality),
+}
+
+# memory budget for memoized centralities (16 MB)
+CENTRALITY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+centrality_cache = DatasetCache(max_bytes=CENTRALITY_CACHE_MAX_BYTES)
+
+
+def graph_fingerprint(G):
+    """
+    Hashes the nodes and edges of a graph. The centralities are unweighted, so attributes are ignored.
+
+    :param G: networkx graph
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(repr((G.is_directed(), list(G.nodes), list(G.edges))).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def centrality(G, metric, fingerprint=None):
+    """
+    Computes a centrality for all nodes of a graph, or returns it from the cache.
+
+    :param G: networkx graph
+    :param metric: key of CENTRALITIES
+    :param fingerprint: graph_fingerprint of G, computed if not given
+    :return: dict {node: value}
+    """
+    key = (fingerprint or graph_fingerprint(G)) + "." + metric
+    values = centrality_cache.get(key)
+    if values is None:
+        values = CENTRALITIES[metric][1](G)
+        centrality_cache.put(key, values)
+    return values
+
+
+def needed_centralities(mappings, statistics=True):
+    """
+    Selects the centralities a network needs, those mapped to its nodes and, if it comes with a statistics table, all.
+
+    :param mappings: node mappings of the network, e.g. node size and node color
+    :param statistics: the network comes with a table of node statistics
+    :return: list of keys of CENTRALITIES
+    """
+    if statistics:
+        return list(CENTRALITIES)
+    return [metric for metric in dict.fromkeys(mappings) if metric in CENTRALITIES]
+
+
+def centrality_table(G, metrics):
+    """
+    Collects the requested centralities of all nodes of a graph.
+
+    :param G: networkx graph
+    :param metrics: keys of CENTRALITIES
+    :return: pandas dataframe with column ID and one column per metric, nodes in graph order
+    """
+    fingerprint = graph_fingerprint(G)
+    table = pd.DataFrame({"ID": list(G.nodes)})
+    for metric in metrics:
+        values = centrality(G, metric, fingerprint)
+        table[CENTRALITIES[metric][0]] = [values.get(node, 0) for node in G.nodes]
+    return table
@@ -0,0 +1,541 @@
+import csv
+import io
+from collections import namedtuple
+from itertools import chain, islice
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+# Single pipeline that reads, validates and normalizes uploaded behavior data.
+# The result holds the cleaned dataframe (None if the data is invalid) and a list of
+# validation errors, each a dict {"row": row in the uploaded file or None, "message": str}
+IngestResult = namedtuple("IngestResult", ["df", "errors"])
+
+# hacky solution for loading example data
+EXAMPLE_DATA = {
+    "example1": r"./public/example_data/1.xlsx",
+    "example2": r"./public/example_data/2.xlsx",
+    "example3": r"./public/example_data/3.xlsx",
+}
+# values that mark the column header row of a BORIS export
+HEADER_NAMES = ["Time", "time", "Subject", "subject", "Status", "Behavior"]
+# meta information before the column headers spans a few dozen rows at most
+HEADER_SCAN_ROWS = 100
+# number of row numbers listed per message in the upload response
+MAX_LISTED_ROWS = 10
+# rows parsed at once when large csv files are streamed
+CHUNK_ROWS = 100000
+# columns of the bout table, one row per shown behavior from its start to its stop
+BOUT_COLUMNS = ["subject", "behavior", "behavioral_category", "modifier_1", "start", "stop", "duration"]
+# leading bytes of excel files, xlsx files are zip archives and xls files OLE2 compound documents
+XLSX_MAGIC = b"PK\x03\x04"
+XLS_MAGIC = b"\xd0\xcf\x11\xe0"
+# columns with few distinct labels, stored as categoricals so filters and groupings work on integer codes
+CATEGORICAL_COLUMNS = ["subject", "behavior", "behavioral_category", "status", "modifier_1", "session"]
+
+
+def find_header_row(rows):
+    """
+    Finds the column header row, i.e. the first row containing one of HEADER_NAMES.
+
+    :param rows: iterable of rows, each a sequence of cell values
+    :return: index of the header row or None
+    """
+    for index, row in enumerate(rows):
+        if any(isinstance(cell, str) and cell in HEADER_NAMES for cell in row):
+            return index
+    return None
+
+
+def head_lines(raw_data, n):
+    """
+    Reads the first n lines of a text file or upload without consuming it.
+
+    :param raw_data: path or file-like object
+    :param n: number of lines
+    :return: list of decoded lines
+    """
+    if isinstance(raw_data, str):
+        with open(raw_data, "rb") as f:
+            lines = [line for _, line in zip(range(n), f)]
+    else:
+        raw_data.seek(0)
+        lines = [line for _, line in zip(range(n), raw_data)]
+        raw_data.seek(0)
+    return [line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line for line in lines]
+
+
+def read_csv_upload(raw_data):
+    """
+    Parses a csv file, skipping meta information before the column headers.
+    The header row is searched in the first HEADER_SCAN_ROWS lines only.
+
+    :param raw_data: path or file-like object
+    :return: 2-tuple (pandas dataframe, index of the header row in the file)
+    """
+    header_row = find_header_row(csv.reader(head_lines(raw_data, HEADER_SCAN_ROWS))) or 0
+    if not isinstance(raw_data, str):
+        raw_data.seek(0)
+    # cells are kept as text like in the exported file, time is converted during cleaning
+    return pd.read_csv(raw_data, skiprows=header_row, dtype=str), header_row
+
+
+def read_excel_upload(raw_data):
+    """
+    Parses a legacy xls file, skipping meta information before the column headers.
+    The header row is searched in the first HEADER_SCAN_ROWS rows only.
+
+    :param raw_data: path or file-like object
+    :return: 2-tuple (pandas dataframe, index of the header row in the file)
+    """
+    if not isinstance(raw_data, str):
+        raw_data.seek(0)
+    head = pd.read_excel(raw_data, header=None, nrows=HEADER_SCAN_ROWS)
+    header_row = find_header_row(head.itertuples(index=False)) or 0
+    if not isinstance(raw_data, str):
+        raw_data.seek(0)
+    # cells are kept as text like in the exported file, time is converted during cleaning
+    return pd.read_excel(raw_data, skiprows=header_row, dtype=str), header_row
+
+
+def detect_file_type(raw_data):
+    """
+    Detects the type of an upload from its leading bytes instead of trying parsers one after another.
+
+    :param raw_data: path or file-like object
+    :return: "xlsx", "xls" or "csv"
+    """
+    if isinstance(raw_data, str):
+        with open(raw_data, "rb") as f:
+            magic = f.read(4)
+    else:
+        raw_data.seek(0)
+        magic = raw_data.read(4)
+        raw_data.seek(0)
+    if magic == XLSX_MAGIC:
+        return "xlsx"
+    if magic == XLS_MAGIC:
+        return "xls"
+    return "csv"
+
+
+def excel_cell(value):
+    """
+    Converts a cell value the way pandas.read_excel does, so streamed and fully loaded workbooks agree.
+
+    :param value: cell value read by openpyxl
+    :return: converted value, "" for empty cells
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str) and value in ERROR_CODES:
+        return np.nan
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and int(value) == value:
+        return int(value)
+    return value
+
+
+def iter_xlsx_rows(raw_data):
+    """
+    Streams the rows of the first worksheet of an xlsx file without loading the workbook into memory.
+    Trailing empty cells and rows are dropped like in pandas.read_excel.
+
+    :param raw_data: path or file-like object
+    :return: generator of rows, each a list of cell values
+    """
+    if not isinstance(raw_data, str):
+        raw_data.seek(0)
+    workbook = openpyxl.load_workbook(raw_data, read_only=True, data_only=True, keep_links=False)
+    try:
+        empty_rows = 0
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            row = [excel_cell(value) for value in row]
+            while row and row[-1] == "":
+                row.pop()
+            if not row:
+                # empty rows are only kept if data follows them
+                empty_rows += 1
+                continue
+            for _ in range(empty_rows):
+                yield []
+            empty_rows = 0
+            yield row
+    finally:
+        workbook.close()
+
+
+def read_xlsx_chunks(raw_data, chunk_rows=CHUNK_ROWS):
+    """
+    Parses an xlsx file in chunks of rows, skipping meta information before the column headers.
+    The header row is searched in the first HEADER_SCAN_ROWS rows only.
+
+    :param raw_data: path or file-like object
+    :param chunk_rows: number of rows per chunk
+    :return: 2-tuple (index of the header row in the file, generator of pandas dataframes with text cells)
+    """
+    rows = iter_xlsx_rows(raw_data)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+    header_row = find_header_row(head) or 0
+    rows = chain(head[header_row + 1:], rows)
+    header = head[header_row] if header_row < len(head) else []
+
+    def chunks():
+        start = 0
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                return
+            # cells right of the header have no column, rows are padded to the header width
+            chunk = [row[:len(header)] + [""] * (len(header) - len(row)) for row in chunk]
+            # same parser as pandas.read_excel, so missing values and duplicate headers are handled alike
+            df = TextParser([header] + chunk, header=0, dtype=str, skip_blank_lines=False).read()
+            # continue the index across chunks like pandas.read_csv, validation reports rows by index
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+
+    return header_row, chunks()
+
+
+def read_csv_chunks(raw_data, chunk_rows=CHUNK_ROWS):
+    """
+    Parses a csv file in chunks of rows, skipping meta information before the column headers.
+
+    :param raw_data: path or file-like object
+    :param chunk_rows: number of rows per chunk
+    :return: 2-tuple (index of the header row in the file, iterator of pandas dataframes with text cells)
+    """
+    header_row = find_header_row(csv.reader(head_lines(raw_data, HEADER_SCAN_ROWS))) or 0
+    if not isinstance(raw_data, str):
+        raw_data.seek(0)
+    return header_row, pd.read_csv(raw_data, skiprows=header_row, dtype=str, chunksize=chunk_rows)
+
+
+def read_chunks(raw_data, chunk_rows=CHUNK_ROWS):
+    """
+    Parses an upload in chunks of rows depending on its file type, legacy xls files are read at once.
+
+    :param raw_data: path or file-like object
+    :param chunk_rows: number of rows per chunk
+    :return: 2-tuple (index of the header row in the file, iterator of pandas dataframes with text cells)
+    """
+    file_type = detect_file_type(raw_data)
+    if file_type == "xlsx":
+        return read_xlsx_chunks(raw_data, chunk_rows)
+    if file_type == "xls":
+        df, header_row = read_excel_upload(raw_data)
+        return header_row, iter([df])
+    return read_csv_chunks(raw_data, chunk_rows)
+
+
+def read_upload(raw_data):
+    """
+    Loads an upload or example dataset depending on its file type.
+
+    :param raw_data: arbitrary file or name of an example dataset
+    :return: 2-tuple (pandas dataframe with the column headers of the file, index of the header row in the file)
+    """
+    if isinstance(raw_data, str) and raw_data in EXAMPLE_DATA:
+        raw_data = EXAMPLE_DATA[raw_data]
+    file_type = detect_file_type(raw_data)
+    if file_type == "csv":
+        return read_csv_upload(raw_data)
+    if file_type == "xls":
+        return read_excel_upload(raw_data)
+    header_row, chunks = read_xlsx_chunks(raw_data)
+    return pd.concat(chunks, ignore_index=True), header_row
+
+
+def normalize_columns(df):
+    """
+    Makes column headers lowercase, substitutes whitespace and unifies the modifier column name.
+
+    :param df: pandas dataframe as read from the file
+    :return: pandas dataframe with normalized column headers
+    """
+    df.columns = [x.lower() for x in df.columns]
+    df.columns = df.columns.str.replace(" ", "_")
+
+    # rename modifier column if it is named 'modifiers'
+    if "modifiers" in df.columns and "modifier_1" not in df.columns:
+        df.rename(columns={"modifiers": "modifier_1"}, inplace=True)
+    if "modifier" in df.columns and "modifier_1" not in df.columns:
+        df.rename(columns={"modifier": "modifier_1"}, inplace=True)
+    return df
+
+
+def is_aggregated(df):
+    """
+    :param df: pandas dataframe with normalized column headers
+    :return: True if the user has exported the BORIS data as 'aggregated events'
+    """
+    return "start_(s)" in df.columns and "time" not in df.columns
+
+
+def validate(df, header_row):
+    """
+    Checks that the required columns are present and filled.
+
+    :param df: pandas dataframe with normalized column headers
+    :param header_row: index of the header row in the file, used to report file row numbers
+    :return: list of validation errors
+    """
+    errors = []
+    time_columns = ["start_(s)", "stop_(s)"] if is_aggregated(df) else ["time"]
+
+    # return error message and instructions if time, subject or behavior are not present
+    for column, name in [(time_columns[0], "Time"), ("subject", "Subject"), ("behavior", "Behavior")]:
+        if column not in df.columns:
+            errors.append({"row": None, "message": f'Required column "{name}" is missing'})
+    if errors:
+        return errors
+
+    # the first data row is the line after the header, rows are counted from 1 like in spreadsheets
+    first_row = header_row + 2
+    for column in time_columns + ["behavior"]:
+        if column not in df.columns:
+            continue
+        for index in df.index[df[column].isnull()]:
+            errors.append({"row": first_row + index, "message": f'Column "{column}" must not have any empty cells'})
+    for column in time_columns:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        not_numeric = pd.to_numeric(values, errors="coerce").isnull() & values.notnull()
+        for index in df.index[not_numeric]:
+            errors.append({"row": first_row + index, "message": f'Column "{column}" must only contain numbers'})
+    return errors
+
+
+def format_errors(errors):
+    """
+    Summarizes validation errors to one line per message, listing the affected rows.
+
+    :param errors: list of validation errors
+    :return: string for the upload response
+    """
+    rows = {}
+    for error in errors:
+        rows.setdefault(error["message"], [])
+        if error["row"] is not None:
+            rows[error["message"]].append(error["row"])
+    response = ""
+    for message, message_rows in rows.items():
+        if message_rows:
+            listed = ", ".join(str(row) for row in message_rows[:MAX_LISTED_ROWS])
+            if len(message_rows) > MAX_LISTED_ROWS:
+                listed += f" and {len(message_rows) - MAX_LISTED_ROWS} more"
+            message += f" (row{'s' if len(message_rows) > 1 else ''} {listed})"
+        response += message + "\n"
+    return response
+
+
+def expand_aggregated_events(df):
+    """
+    Splits 'aggregated events' into separate START and STOP events.
+    Starts and stops are interleaved and ordered with one stable argsort, so each row is
+    copied once instead of copying, appending and sorting the whole frame twice.
+
+    :param df: pandas dataframe with columns start_(s) and stop_(s)
+    :return: pandas dataframe with columns time and status, sorted by time
+    """
+    n = len(df)
+    times = np.empty(2 * n)
+    times[0::2] = df["start_(s)"].astype(float).to_numpy()
+    times[1::2] = df["stop_(s)"].astype(float).to_numpy()
+    # stable order keeps the START of an event before its STOP and simultaneous events in file order
+    order = np.argsort(times, kind="stable")
+
+    dropped = ["start_(s)", "stop_(s)", "duration_(s)", "status"]
+    # time takes the place of start_(s)
+    position = len([col for col in df.columns[: df.columns.get_loc("start_(s)")] if col not in dropped])
+    df = df.drop(dropped, axis=1, errors="ignore")
+    df = df.iloc[np.repeat(np.arange(n), 2)[order]].reset_index(drop=True)
+    df.insert(position, "time", times[order])
+    df["status"] = np.where(order % 2 == 0, "START", "STOP")
+    return df
+
+
+def iter_ingest(raw_data, errors, chunk_rows=CHUNK_ROWS):
+    """
+    Streaming variant of ingest for large csv and xlsx files, reading chunk_rows rows at a time.
+    Cleaned chunks are yielded in time order, total_length is not added.
+    Validation errors are appended to errors; once there is one no more chunks are yielded,
+    but the rest of the file is still validated.
+
+    :param raw_data: path or file-like object of a csv or xlsx file
+    :param errors: list that collects validation errors
+    :param chunk_rows: number of rows parsed at once
+    :return: generator of cleaned pandas dataframes
+    """
+    try:
+        header_row, chunks = read_chunks(raw_data, chunk_rows)
+    except:
+        errors.append({"row": None, "message": "Could not parse dataset"})
+        return
+
+    # aggregated events of later rows start later, but a stop may come after the next chunk's starts,
+    # so events after the latest start of a chunk are held back and merged into the next one
+    pending = None
+    for chunk in chunks:
+        try:
+            chunk = normalize_columns(chunk)
+        except:
+            errors.append({"row": None, "message": "could not parse column headers"})
+            return
+        chunk_errors = validate(chunk, header_row)
+        errors.extend(chunk_errors)
+        if any(error["row"] is None for error in chunk_errors):
+            return
+        if errors:
+            continue
+
+        if is_aggregated(chunk):
+            last_start = chunk["start_(s)"].astype(float).max()
+            chunk = expand_aggregated_events(chunk)
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True).sort_values("time", kind="stable")
+            pending = chunk[chunk.time > last_start].reset_index(drop=True)
+            chunk = chunk[chunk.time <= last_start].reset_index(drop=True)
+        yield complete(chunk, add_total_length=False)
+
+    if pending is not None and not errors:
+        yield complete(pending, add_total_length=False)
+
+
+def complete(df, add_total_length=True):
+    """
+    Fills in missing values which are needed for proper data handling.
+
+    :param df: validated pandas dataframe
+    :param add_total_length: add column total_length if missing, i.e. the last point in time
+    :return: cleaned pandas dataframe
+    """
+    # convert time to float as cells are read as text
+    df.time = df.time.astype(float)
+
+    # add missing columns
+    if "modifier_1" not in df.columns:
+        df["modifier_1"] = "unknown"
+    if "behavioral_category" not in df.columns:
+        df["behavioral_category"] = "No behavioral categories present"
+    if "status" not in df.columns:
+        df["status"] = "unknown"
+    if add_total_length and "total_length" not in df.columns:
+        df["total_length"] = df["time"].iloc[-1]
+
+    # fill empty values with some 'unknown' value
+    df.behavioral_category.fillna("unknown", inplace=True)
+    return df
+
+
+def compact(df, float32_time=False):
+    """
+    Converts label columns and other repetitive text columns to categoricals, i.e. integer codes plus a small table of labels.
+
+    :param df: cleaned pandas dataframe
+    :param float32_time: store time as float32, which halves its memory but limits the precision for long recordings
+    :return: pandas dataframe with categorical label columns
+    """
+    for col in df.columns:
+        # other text columns like media file path or fps repeat a handful of values as well
+        if col in CATEGORICAL_COLUMNS or (df[col].dtype == object and df[col].nunique() <= len(df) // 2):
+            df[col] = df[col].astype("category")
+    if float32_time:
+        df.time = df.time.astype("float32")
+    return df
+
+
+def build_bouts(df):
+    """
+    Pairs the START and STOP events of state behaviors, the k-th START of a behavior of a subject
+    with its k-th STOP. Point events and events without status become bouts of zero duration,
+    STARTs without STOP are left out.
+
+    :param df: cleaned pandas dataframe
+    :return: pandas dataframe with BOUT_COLUMNS (and session for batch uploads), sorted by start
+    """
+    keys = ["subject", "behavior"] + (["session"] if "session" in df.columns else [])
+    is_start = (df.status == "START").to_numpy()
+    is_stop = (df.status == "STOP").to_numpy()
+
+    # rank events per key as integer codes, so events without subject are paired among themselves as well
+    codes = pd.DataFrame(
+        {
+            key: df[key].cat.codes.to_numpy() if isinstance(df[key].dtype, pd.CategoricalDtype) else pd.factorize(df[key])[0]
+            for key in keys
+        }
+    )
+    codes["stop"] = is_stop
+    codes = codes[is_start | is_stop]
+    codes["rank"] = codes.groupby(keys + ["stop"]).cumcount()
+    pairs = codes[~codes.stop].reset_index().merge(codes[codes.stop].reset_index(), on=keys + ["rank"])
+
+    states = df.iloc[pairs.index_x.to_numpy()].rename(columns={"time": "start"})
+    states["stop"] = df.time.to_numpy()[pairs.index_y.to_numpy()]
+    points = df[~(is_start | is_stop)].rename(columns={"time": "start"})
+    points["stop"] = points.start
+
+    bouts = pd.concat([states, points], ignore_index=True)
+    bouts["duration"] = bouts.stop - bouts.start
+    columns = BOUT_COLUMNS + (["session"] if "session" in df.columns else [])
+    return bouts.sort_values("start", kind="stable", ignore_index=True)[columns]
+
+
+def ingest(raw_data, float32_time=False):
+    """
+    Reads, validates and cleans a data upload in a single pass.
+
+    :param raw_data: arbitrary file or name of an example dataset
+    :param float32_time: store time as float32, see compact
+    :return: IngestResult with the cleaned dataframe, or None and the reasons why the data cannot be handled
+    """
+    try:
+        df, header_row = read_upload(raw_data)
+    except:
+        return IngestResult(None, [{"row": None, "message": "Could not parse dataset"}])
+
+    try:
+        df = normalize_columns(df)
+    except:
+        return IngestResult(None, [{"row": None, "message": "could not parse column headers"}])
+
+    errors = validate(df, header_row)
+    if errors:
+        return IngestResult(None, errors)
+
+    if is_aggregated(df):
+        df = expand_aggregated_events(df)
+    return IngestResult(compact(complete(df), float32_time), [])
+
+
+def ingest_bytes(name, content, float32_time=False):
+    """
+    Runs ingest on the content of an uploaded file, used by worker processes which cannot receive django uploads.
+
+    :param name: file name of the upload
+    :param content: bytes of the upload
+    :param float32_time: store time as float32, see compact
+    :return: IngestResult
+    """
+    raw_data = io.BytesIO(content)
+    raw_data.name = name
+    return ingest(raw_data, float32_time)
+
+
+def merge_sessions(sessions):
+    """
+    Combines the cleaned datasets of several recording sessions into one, marking each event with its session.
+
+    :param sessions: list of 2-tuples (session name, cleaned pandas dataframe)
+    :return: compacted pandas dataframe with column session
+    """
+    frames = []
+    for name, df in sessions:
+        df = df.copy()
+        df["session"] = name
+        frames.append(df)
+    # label columns with differing categories are concatenated as text, so compact them again
+    return compact(pd.concat(frames, ignore_index=True), frames[0].time.dtype == "float32")
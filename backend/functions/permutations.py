@@ -0,0 +1,148 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .transitions import codes_and_labels, group_codes
+
+# Permutation test for transition counts. The null model shuffles the events within each subject (and session),
+# which keeps how often every behavior occurs but destroys their order. Permutations are drawn in batches on
+# integer codes and the batches are spread over worker processes.
+
+# number of permutations if not specified
+DEFAULT_PERMUTATIONS = 1000
+# seed if not specified, so repeated tests give the same results and can be cached
+DEFAULT_SEED = 0
+# elements per batch, the larger of permutations × events (random keys) and permutations × codes² (counts),
+# bounds the memory of a batch
+BATCH_ELEMENTS = 4 * 1024 * 1024
+
+
+def coded_sequences(df, id_list, column):
+    """
+    Encodes the events the transitions are counted from, see transitions.count_transitions, as one
+    array of behavior codes sorted by subject. Missing behaviors get the largest code.
+
+    :param df: events in temporal order
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :return: 3-tuple (numpy array of codes, numpy array of group ranks, numpy array of labels)
+    """
+    events = df[(df.status != "STOP") & df.subject.isin(id_list)]
+    keys = ["subject"] + (["session"] if "session" in events.columns else [])
+    group = group_codes(events, keys)
+    order = np.argsort(group, kind="stable")
+    actions, labels = codes_and_labels(events[column])
+    actions = np.where(actions < 0, len(labels), actions)[order]
+    # consecutive ranks, so a random number in [0, 1) added to them only reorders within a group
+    ranks = np.unique(group[order], return_inverse=True)[1]
+    return actions.astype(np.int64), ranks.astype(np.float64), labels
+
+
+def batch_size(n_events, size):
+    """
+    Number of permutations drawn at once, so neither the random keys nor the counts exceed BATCH_ELEMENTS.
+
+    :param n_events: number of events per permutation
+    :param size: number of codes
+    :return: int
+    """
+    return max(1, BATCH_ELEMENTS // max(n_events, size * size, 1))
+
+
+def pair_counts(sequences, same, size):
+    """
+    Counts the transitions of a batch of sequences at once.
+
+    :param sequences: 2d numpy array, one sequence of codes per row
+    :param same: mask of the positions whose successor belongs to the same group
+    :param size: number of codes
+    :return: 2d numpy array, one row of size × size counts per sequence
+    """
+    pairs = sequences[:, :-1] * size + sequences[:, 1:]
+    # offset every row so a single bincount counts all rows
+    pairs = pairs + (np.arange(len(sequences)) * size * size)[:, None]
+    counts = np.bincount(pairs[:, same].ravel(), minlength=len(sequences) * size * size)
+    return counts.reshape(len(sequences), size * size)
+
+
+def null_statistics(actions, ranks, size, observed, n_permutations, seed):
+    """
+    Draws permutations and summarizes their transition counts, run in a worker process.
+
+    :param actions: codes, see coded_sequences
+    :param ranks: group ranks, see coded_sequences
+    :param size: number of codes
+    :param observed: observed counts, flattened
+    :param n_permutations: number of permutations
+    :param seed: numpy SeedSequence
+    :return: 3-tuple of flattened arrays (sum of counts, sum of squared counts, permutations with at least the observed count)
+    """
+    rng = np.random.default_rng(seed)
+    same = ranks[:-1] == ranks[1:]
+    total = np.zeros(size * size)
+    squares = np.zeros(size * size)
+    exceed = np.zeros(size * size, dtype=np.int64)
+    batch = batch_size(len(actions), size)
+    for start in range(0, n_permutations, batch):
+        n = min(batch, n_permutations - start)
+        permutations = np.argsort(ranks + rng.random((n, len(actions))), axis=1)
+        counts = pair_counts(actions[permutations], same, size)
+        total += counts.sum(axis=0)
+        squares += (counts.astype(np.float64) ** 2).sum(axis=0)
+        exceed += (counts >= observed).sum(axis=0)
+    return total, squares, exceed
+
+
+def permutation_test(df, id_list, column, n_permutations=DEFAULT_PERMUTATIONS, seed=DEFAULT_SEED):
+    """
+    Tests for every observed transition whether it occurs more often than in shuffled sequences.
+
+    :param df: events in temporal order
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :param n_permutations: number of permutations
+    :param seed: seed of the random generator, None for a random seed
+    :return: pandas dataframe with columns action_1, action_2, records, expected, z_score and p_value (one-sided)
+    """
+    actions, ranks, labels = coded_sequences(df, id_list, column)
+    size = len(labels) + 1
+    observed = pair_counts(actions[None, :], ranks[:-1] == ranks[1:], size)[0]
+
+    # one chunk of permutations per worker, each with an independent random stream. Small tests fit into a few
+    # batches, they get no more workers than batches
+    batches = -(-n_permutations // batch_size(len(actions), size))
+    workers = max(1, min(batches, getattr(settings, "PERMUTATION_WORKERS", None) or os.cpu_count()))
+    chunks = [len(chunk) for chunk in np.array_split(np.arange(n_permutations), workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    if workers == 1:
+        results = [null_statistics(actions, ranks, size, observed, chunks[0], seeds[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(null_statistics, repeat(actions), repeat(ranks), repeat(size), repeat(observed), chunks, seeds)
+            )
+    total, squares, exceed = (np.sum(values, axis=0) for values in zip(*results))
+
+    expected = total / n_permutations
+    std = np.sqrt(np.maximum(squares / n_permutations - expected ** 2, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_score = np.where(std > 0, (observed - expected) / std, np.nan)
+    p_value = (exceed + 1) / (n_permutations + 1)
+
+    # observed transitions between behaviors, transitions from or to missing values are not tested
+    pairs = np.flatnonzero(observed)
+    first, second = pairs // size, pairs % size
+    valid = (first < len(labels)) & (second < len(labels))
+    pairs, first, second = pairs[valid], first[valid], second[valid]
+    return pd.DataFrame(
+        {
+            "action_1": labels[first],
+            "action_2": labels[second],
+            "records": observed[pairs],
+            "expected": expected[pairs],
+            "z_score": z_score[pairs],
+            "p_value": p_value[pairs],
+        }
+    )
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import os
+import math
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from .artifacts import temporary_path
+from .cache import DatasetCache
+
+# Graphviz rendering. Graphs are written as DOT straight from their node and edge attributes and laid out
+# by a bounded pool of workers, so concurrent requests queue instead of starting any number of dot processes.
+# Layouts are cached per graph geometry, graphs that only differ in their colors and styles are drawn from
+# the cached positions without running the layout again.
+
+# seconds a request waits for its image if not set with RENDER_TIMEOUT in settings.py
+DEFAULT_RENDER_TIMEOUT = 60
+
+# memory budget for cached layouts (16 MB)
+LAYOUT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+layout_cache = DatasetCache(max_bytes=LAYOUT_CACHE_MAX_BYTES)
+
+# workers running dot, RENDER_WORKERS in settings.py, None uses one per CPU
+render_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, "RENDER_WORKERS", None) or os.cpu_count(), thread_name_prefix="render"
+)
+
+
+def dot_id(value):
+    """
+    :param value: node name or attribute value
+    :return: value as quoted DOT string
+    """
+    # backslashes first, so the ones escaping quotes are not doubled
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def dot_attributes(attributes):
+    """
+    :param attributes: dict of graphviz attributes
+    :return: DOT attribute list, e.g. ' [label="3", penwidth="0.5"]', empty string if there are none
+    """
+    if not attributes:
+        return ""
+    return " [" + ", ".join("{}={}".format(key, dot_id(value)) for key, value in attributes.items()) + "]"
+
+
+def to_dot(G):
+    """
+    Serializes a networkx graph with its node, edge and graph attributes as DOT, without converting it to pydot.
+    Default attributes for the graph, all nodes or all edges are taken from G.graph["graph"], G.graph["node"]
+    and G.graph["edge"] like networkx does.
+
+    :param G: networkx graph or digraph
+    :return: DOT source
+    """
+    lines = ["digraph {" if G.is_directed() else "graph {"]
+    for key in ["graph", "node", "edge"]:
+        if G.graph.get(key):
+            lines.append(key + dot_attributes(G.graph[key]) + ";")
+    for node, attributes in G.nodes(data=True):
+        lines.append(dot_id(node) + dot_attributes(attributes) + ";")
+    edge_op = " -> " if G.is_directed() else " -- "
+    for u, v, attributes in G.edges(data=True):
+        lines.append(dot_id(u) + edge_op + dot_id(v) + dot_attributes(attributes) + ";")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def run_graphviz(source_path, outputs, timeout, engine="dot", options=()):
+    """
+    Runs graphviz on a saved DOT file, in a render worker. One run can write several output formats.
+    They are written under temporary names and renamed once graphviz succeeded, so no file is seen half written.
+
+    :param source_path: DOT file
+    :param outputs: list of 2-tuples (graphviz output format, destination)
+    :param timeout: seconds until the graphviz process is killed
+    :param engine: graphviz layout engine
+    :param options: further command line options
+    """
+    tmp_paths = [temporary_path(output_path) for _, output_path in outputs]
+    output_args = [arg for (output_format, _), tmp_path in zip(outputs, tmp_paths) for arg in ("-T" + output_format, "-o" + tmp_path)]
+    try:
+        subprocess.run([engine, *options, *output_args, source_path], check=True, capture_output=True, timeout=timeout)
+        for (_, output_path), tmp_path in zip(outputs, tmp_paths):
+            os.replace(tmp_path, output_path)
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def render_dot(source, path, timeout=None, engine="dot", options=(), layout_path=None):
+    """
+    Saves DOT source as path.gv and renders it to path.gv.svg with the render pool, waiting at most timeout seconds.
+
+    :param source: DOT source
+    :param path: location of the files without extension
+    :param timeout: seconds to wait, RENDER_TIMEOUT in settings.py if not given
+    :param engine: graphviz layout engine
+    :param options: further command line options
+    :param layout_path: also save the computed layout as json here
+    :raise TimeoutError: if the image is not rendered in time
+    """
+    timeout = timeout or getattr(settings, "RENDER_TIMEOUT", DEFAULT_RENDER_TIMEOUT)
+    with open(path + ".gv", "w", encoding="utf-8") as f:
+        f.write(source)
+    outputs = [("svg", path + ".gv.svg")] + ([("json0", layout_path)] if layout_path else [])
+    future = render_pool.submit(run_graphviz, path + ".gv", outputs, timeout, engine, options)
+    try:
+        future.result(timeout=timeout)
+    except TimeoutError:
+        # drop the job if it is still queued, a running dot process is killed after timeout by itself
+        future.cancel()
+        raise
+
+
+# attributes that change the size of nodes, edge labels or the graph, and therefore its layout
+LAYOUT_ATTRIBUTES = ["label", "width", "height", "fontsize", "fontname", "shape", "fixedsize", "margin"]
+
+
+def layout_key(G):
+    """
+    Hashes everything a graphviz layout depends on: the nodes and edges of a graph with the attributes
+    that determine their size, and the graph attributes. Colors and styles are left out, so graphs that
+    only differ in those keep the key.
+
+    :param G: networkx graph
+    :return: hex digest
+    """
+    geometry = lambda attributes: {key: attributes[key] for key in LAYOUT_ATTRIBUTES if key in attributes}
+    structure = [
+        G.is_directed(),
+        G.graph.get("graph", {}),
+        geometry(G.graph.get("node", {})),
+        geometry(G.graph.get("edge", {})),
+        [(node, geometry(attributes)) for node, attributes in G.nodes(data=True)],
+        [(u, v, geometry(attributes)) for u, v, attributes in G.edges(data=True)],
+    ]
+    return hashlib.sha256(json.dumps(structure, default=str).encode("utf-8")).hexdigest()
+
+
+def run_layout(source, timeout, engine="dot"):
+    """
+    Lays out DOT source without writing any file, in a render worker.
+
+    :param source: DOT source
+    :param timeout: seconds until the graphviz process is killed
+    :param engine: graphviz layout engine
+    :return: json0 output of graphviz
+    """
+    result = subprocess.run(
+        [engine, "-Tjson0"], input=source, check=True, capture_output=True, text=True, timeout=timeout
+    )
+    return result.stdout
+
+
+def parse_layout(layout):
+    """
+    Extracts the positions of nodes, edge splines and labels from the json output of graphviz.
+
+    :param layout: decoded json0 output of graphviz
+    :return: dict with graph attributes and lists of node and edge attributes, in the order they were declared
+    """
+    # objects are nodes and subgraphs, subgraphs list their nodes
+    nodes = sorted((obj for obj in layout.get("objects", []) if "nodes" not in obj), key=lambda obj: obj["_gvid"])
+    edges = sorted(layout.get("edges", []), key=lambda edge: edge["_gvid"])
+    pick = lambda obj, keys: {key: obj[key] for key in keys if key in obj}
+    return {
+        "graph": pick(layout, ["bb", "lp"]),
+        "nodes": [pick(node, ["pos"]) for node in nodes],
+        "edges": [pick(edge, ["pos", "lp"]) for edge in edges],
+    }
+
+
+def read_layout(layout_path):
+    """
+    :param layout_path: json0 file written by graphviz
+    :return: dict, see parse_layout
+    """
+    with open(layout_path, encoding="utf-8") as f:
+        return parse_layout(json.load(f))
+
+
+def graph_layout(G, timeout=None):
+    """
+    Computes the graphviz layout of a graph without rendering it, or returns it from the cache.
+
+    :param G: networkx graph with graphviz attributes
+    :param timeout: seconds to wait, RENDER_TIMEOUT in settings.py if not given
+    :return: dict, see parse_layout
+    :raise TimeoutError: if the layout is not computed in time
+    """
+    key = layout_key(G)
+    layout = layout_cache.get(key)
+    if layout is None:
+        timeout = timeout or getattr(settings, "RENDER_TIMEOUT", DEFAULT_RENDER_TIMEOUT)
+        future = render_pool.submit(run_layout, to_dot(G), timeout)
+        try:
+            layout = parse_layout(json.loads(future.result(timeout=timeout)))
+        except TimeoutError:
+            future.cancel()
+            raise
+        layout_cache.put(key, layout)
+    return layout
+
+
+def with_layout(G, layout):
+    """
+    Copies a graph and pins its nodes, edges and labels to a cached layout.
+
+    :param G: networkx graph
+    :param layout: dict, see read_layout
+    :return: networkx graph
+    """
+    H = G.copy()
+    H.graph["graph"] = dict(G.graph.get("graph", {}), **layout["graph"])
+    for node, attributes in zip(list(H.nodes), layout["nodes"]):
+        H.nodes[node].update(attributes)
+    for (u, v), attributes in zip(list(H.edges), layout["edges"]):
+        H.edges[u, v].update(attributes)
+    return H
+
+
+def json_value(value):
+    """
+    :param value: attribute value, possibly a numpy scalar
+    :return: value as json serializable python value, None for NaN
+    """
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def points(pos):
+    """
+    :param pos: graphviz point list, e.g. "27,18 27,90"
+    :return: list of [x, y]
+    """
+    return [[float(coordinate) for coordinate in point.split(",")[:2]] for point in pos.split()]
+
+
+def spline(pos):
+    """
+    Splits a graphviz edge spline into its control points and the optional start and end points of the arrowheads.
+
+    :param pos: graphviz spline, e.g. "e,27,36.1 27,71.7 27,63.98 27,54.71 27,46.11"
+    :return: dict with points and optionally start and end
+    """
+    result = {}
+    parts = pos.split()
+    while parts and parts[0][:2] in ["s,", "e,"]:
+        result["start" if parts[0][0] == "s" else "end"] = points(parts[0][2:])[0]
+        parts = parts[1:]
+    result["points"] = points(" ".join(parts))
+    return result
+
+
+def graph_json(G, coordinates=False, statistics=None, timeout=None):
+    """
+    Describes a graph with its attributes as compact json for rendering it on the client, no files are written.
+
+    :param G: networkx graph with graphviz attributes
+    :param coordinates: add the positions of the graphviz layout, in points with the origin at the bottom left
+    :param statistics: pandas dataframe added as list of records, e.g. the node statistics otherwise saved as csv
+    :param timeout: seconds to wait for the layout, RENDER_TIMEOUT in settings.py if not given
+    :return: dict with directed, graph attributes, list of nodes (id and attributes), list of edges (source,
+        target and attributes) and optionally statistics
+    """
+    attributes = lambda values: {key: json_value(value) for key, value in values.items()}
+    result = {
+        "directed": G.is_directed(),
+        "graph": attributes(G.graph.get("graph", {})),
+        "nodes": [dict(attributes(values), id=json_value(node)) for node, values in G.nodes(data=True)],
+        "edges": [
+            dict(attributes(values), source=json_value(u), target=json_value(v)) for u, v, values in G.edges(data=True)
+        ],
+    }
+    if statistics is not None:
+        result["statistics"] = [attributes(row) for row in statistics.to_dict("records")]
+    if coordinates:
+        layout = graph_layout(G, timeout)
+        if "bb" in layout["graph"]:
+            result["graph"]["bb"] = [float(value) for value in layout["graph"]["bb"].split(",")]
+        if "lp" in layout["graph"]:
+            result["graph"]["lp"] = points(layout["graph"]["lp"])[0]
+        for node, position in zip(result["nodes"], layout["nodes"]):
+            if "pos" in position:
+                node["pos"] = points(position["pos"])[0]
+        for edge, position in zip(result["edges"], layout["edges"]):
+            if "pos" in position:
+                edge["pos"] = spline(position["pos"])
+            if "lp" in position:
+                edge["lp"] = points(position["lp"])[0]
+    return result
+
+
+def render_graph(G, path, timeout=None):
+    """
+    Renders a networkx graph to path.gv.svg, the DOT source is saved as path.gv.
+    The layout of a graph with the same nodes, edges and sizes is reused if cached, only drawing it with neato -n2.
+
+    :param G: networkx graph with graphviz attributes
+    :param path: location of the files without extension
+    :param timeout: seconds to wait, RENDER_TIMEOUT in settings.py if not given
+    """
+    key = layout_key(G)
+    layout = layout_cache.get(key)
+    if layout is not None:
+        render_dot(to_dot(with_layout(G, layout)), path, timeout, engine="neato", options=["-n2"])
+        return
+
+    layout_path = path + ".layout.json"
+    render_dot(to_dot(G), path, timeout, layout_path=layout_path)
+    try:
+        layout_cache.put(key, read_layout(layout_path))
+    finally:
+        os.remove(layout_path)
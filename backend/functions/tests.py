@@ -1,3 +1,855 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from collections import Counter
+from unittest import mock
+import networkx as nx
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from .artifacts import artifact_path, existing_url, localhost, request_params
+from .cache import DatasetCache, dataset_cache, hash_upload
+from .comparisons import tensor_to_graphs
+from .datasets import (
+    dataset_from_request,
+    dataset_id_from_request,
+    dataset_path,
+    ingest_batch,
+    ingest_upload,
+    read_bouts,
+    read_dataset,
+    session_names,
+    store_dataset,
+)
+from .graphstats import CENTRALITIES, centrality_cache, centrality_table, needed_centralities
+from .helpers import get_behavior_times, get_fish_ids
+from .ingest import (
+    EXAMPLE_DATA,
+    HEADER_SCAN_ROWS,
+    XLS_MAGIC,
+    XLSX_MAGIC,
+    build_bouts,
+    detect_file_type,
+    find_header_row,
+    format_errors,
+    ingest,
+    iter_ingest,
+    merge_sessions,
+    read_upload,
+    read_xlsx_chunks,
+)
+from .permutations import BATCH_ELEMENTS, DEFAULT_SEED, batch_size, permutation_test
+from .rendering import dot_attributes, dot_id, graph_layout, layout_cache, layout_key, render_pool, to_dot
+from .transitions import (
+    count_subject_transitions,
+    count_transitions,
+    transition_frequencies,
+    transition_matrix,
+    transition_tensor,
+    windowed_transitions,
+)
+from .views import BehaviorPlotView
+from .visualizations import transition_tables
+
+# Behavior tests of the data pipeline, run with "python manage.py test functions" from the backend directory.
+
+# meta information BORIS writes before the column headers
+PREAMBLE = "Observation id,test\nObservation date,2024-01-01\n\n"
+EVENTS = """Time,Subject,Behavior,Behavioral category,Status
+1.0,a,swim,locomotion,START
+2.5,b,bite,aggression,POINT
+3.0,a,swim,locomotion,STOP
+4.0,a,bite,aggression,POINT
+"""
+# a behavioral category with a point behavior (bite) and a state behavior (chase)
+MIXED_STATUSES = """Time,Subject,Behavior,Behavioral category,Status
+1.0,a,swim,locomotion,START
+2.0,a,swim,locomotion,STOP
+2.5,a,bite,aggression,POINT
+3.0,a,swim,locomotion,START
+4.0,a,swim,locomotion,STOP
+5.0,a,chase,aggression,START
+6.0,a,chase,aggression,STOP
+7.0,a,swim,locomotion,START
+8.0,a,swim,locomotion,STOP
+"""
+# the same kind of data exported as aggregated events, one row per bout
+AGGREGATED = """Subject,Behavior,Behavioral category,Start (s),Stop (s),Duration (s)
+a,swim,locomotion,1.0,3.0,2.0
+b,bite,aggression,2.5,2.5,0
+a,rest,idle,3.0,6.0,3.0
+"""
+# aggregated events whose stops lie after the starts of later rows
+OVERLAPPING = """Subject,Behavior,Behavioral category,Start (s),Stop (s),Duration (s)
+a,swim,locomotion,1.0,10.0,9.0
+b,bite,aggression,2.0,2.0,0
+a,rest,idle,3.0,4.0,1.0
+b,swim,locomotion,5.0,12.0,7.0
+a,bite,aggression,11.0,11.0,0
+"""
+
+
+def csv_upload(text, name="upload.csv"):
+    """
+    Wraps csv text like an uploaded file.
+
+    :param text: content of the file
+    :param name: file name
+    :return: file-like object
+    """
+    upload = io.BytesIO(text.encode("utf-8"))
+    upload.name = name
+    return upload
+
+
+def load_example(name):
+    """
+    Parses an example dataset, see ingest.EXAMPLE_DATA.
+
+    :param name: name of the example dataset
+    :return: cleaned pandas dataframe
+    """
+    result = ingest(name)
+    assert result.df is not None, result.errors
+    return result.df
+
+
+def subject_sequences(df, id_list):
+    """
+    Lists the events transitions are counted from, one list per subject (and session) in temporal order.
+
+    :param df: pandas dataframe
+    :param id_list: list of selected subjects
+    :return: list of lists of event rows
+    """
+    sequences = {}
+    for row in df.itertuples(index=False):
+        if row.status == "STOP" or row.subject not in id_list:
+            continue
+        sequences.setdefault((row.subject, getattr(row, "session", None)), []).append(row)
+    return list(sequences.values())
+
+
+def loop_transitions(df, id_list, column, order=1):
+    """
+    Counts transitions event by event, see transitions.count_transitions.
+
+    :param df: pandas dataframe
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :param order: number of behaviors per state
+    :return: Counter {(action_1, status_1, action_2, status_2): records}
+    """
+    counts = Counter()
+    for events in subject_sequences(df, id_list):
+        for i in range(len(events) - order):
+            sequence = events[i : i + order + 1]
+            actions = [getattr(event, column) for event in sequence]
+            if any(pd.isna(action) for action in actions):
+                continue
+            status_1 = "" if sequence[-2].status == "POINT" else sequence[-2].status
+            status_2 = "" if sequence[-1].status == "POINT" else sequence[-1].status
+            counts[(" → ".join(actions[:-1]), status_1, " → ".join(actions[1:]), status_2)] += 1
+    return counts
+
+
+def loop_windows(df, id_list, column, starts, window):
+    """
+    Counts the transitions within every window separately, see transitions.windowed_transitions.
+
+    :param df: pandas dataframe
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :param starts: start times of the windows
+    :param window: length of the windows in seconds
+    :return: list of Counters {(action_1, action_2): records}, one per window
+    """
+    windows = [Counter() for _ in starts]
+    for events in subject_sequences(df, id_list):
+        for first, second in zip(events, events[1:]):
+            if pd.isna(getattr(first, column)) or pd.isna(getattr(second, column)):
+                continue
+            for i, start in enumerate(starts):
+                if start <= first.time and second.time < start + window:
+                    windows[i][(getattr(first, column), getattr(second, column))] += 1
+    return windows
+
+
+def as_counter(edges_df):
+    """
+    Converts a table of transition counts into a Counter.
+
+    :param edges_df: pandas dataframe with columns action_1, status_1, action_2, status_2 and records
+    :return: Counter {(action_1, status_1, action_2, status_2): records}
+    """
+    keys = zip(edges_df.action_1, edges_df.status_1, edges_df.action_2, edges_df.status_2)
+    return Counter(dict(zip(keys, edges_df.records.tolist())))
+
+
+class StoreTestCase(SimpleTestCase):
+    """
+    Stores datasets in a temporary directory with an empty dataset cache.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = self.settings(DATASET_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        dataset_cache.clear()
+        self.addCleanup(dataset_cache.clear)
+
+
+class DatasetCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = DatasetCache(max_bytes=3000)
+        for key in "abc":
+            cache.put(key, np.zeros(1000, dtype=np.uint8))
+        # reading a marks it as recently used, so b is evicted first
+        cache.get("a")
+        cache.put("d", np.zeros(1000, dtype=np.uint8))
+        self.assertIsNone(cache.get("b"))
+        for key in "acd":
+            self.assertIsNotNone(cache.get(key))
+        self.assertEqual(cache.stats()["bytes"], 3000)
+
+    def test_byte_budget(self):
+        cache = DatasetCache(max_bytes=3000)
+        cache.put("a", np.zeros(1000, dtype=np.uint8))
+        cache.put("b", np.zeros(2500, dtype=np.uint8))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 2500)
+        # values larger than the whole budget are not cached and evict nothing
+        cache.put("c", np.zeros(4000, dtype=np.uint8))
+        self.assertIsNone(cache.get("c"))
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_replace_entry(self):
+        cache = DatasetCache(max_bytes=3000)
+        cache.put("a", np.zeros(1000, dtype=np.uint8))
+        cache.put("a", np.zeros(2000, dtype=np.uint8))
+        self.assertEqual(len(cache.get("a")), 2000)
+        self.assertEqual(cache.stats()["bytes"], 2000)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_hits_and_misses(self):
+        cache = DatasetCache(max_bytes=3000)
+        cache.put("a", np.zeros(10, dtype=np.uint8))
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 1))
+
+    def test_hash_upload(self):
+        self.assertEqual(hash_upload("example1"), hash_upload("example1"))
+        self.assertNotEqual(hash_upload("example1"), hash_upload("example2"))
+
+
+class DatasetStoreTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.df = load_example("example1")
+        self.dataset_id = hash_upload("example1-test")
+        store_dataset(self.dataset_id, self.df)
+
+    def test_read_dataset(self):
+        df = read_dataset(self.dataset_id)
+        pd.testing.assert_frame_equal(df, self.df.reset_index(drop=True), check_categorical=False)
+        self.assertFalse(read_bouts(self.dataset_id).empty)
+
+    def test_unknown_dataset(self):
+        self.assertIsNone(read_dataset(hash_upload("unknown")))
+        self.assertIsNone(read_dataset("../" + self.dataset_id))
+        self.assertIsNone(read_bouts("not an id"))
+
+    def test_views_do_not_change_the_cached_dataset(self):
+        df = read_dataset(self.dataset_id)
+        df["selected"] = df.behavior
+        df["time"] = df.time + 1
+        again = read_dataset(self.dataset_id)
+        self.assertNotIn("selected", again.columns)
+        self.assertEqual(again.time.iloc[0], self.df.time.iloc[0])
+        # the data itself is shared with the cached frame, not copied
+        self.assertTrue(np.shares_memory(again.time.to_numpy(), read_dataset(self.dataset_id).time.to_numpy()))
+
+    def test_dataset_from_request(self):
+        dataset_id, df = dataset_from_request({"dataset": self.dataset_id})
+        self.assertEqual((dataset_id, len(df)), (self.dataset_id, len(self.df)))
+        self.assertEqual(dataset_id_from_request({"dataset": self.dataset_id}), self.dataset_id)
+        for data in [{}, {"dataset": hash_upload("unknown")}, {"dataset": "not an id"}]:
+            self.assertEqual(dataset_from_request(data), (None, None))
+            self.assertIsNone(dataset_id_from_request(data))
+
+
+class ArtifactTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = hash_upload("example1-test")
+        store_dataset(self.dataset_id, load_example("example1"))
+        # artifacts are saved relative to the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.root)
+
+    def test_request_params(self):
+        params = request_params({"dataset": self.dataset_id, "id_list": '["a", "b"]', "node_size_map": "amount"})
+        self.assertEqual(params, {"id_list": ["a", "b"], "node_size_map": "amount"})
+
+    def test_artifact_path(self):
+        params = {"min_edge_count": 1, "id_list": ["a", "b"]}
+        path = artifact_path("plots", "plot", self.dataset_id, "behaviorplot", params)
+        self.assertRegex(path, r"^public/plots/plot-[0-9a-f]{64}$")
+        # the order of the parameters does not matter, their values, the dataset and the view do
+        same = request_params({"id_list": '["a","b"]', "min_edge_count": "1", "dataset": self.dataset_id})
+        self.assertEqual(artifact_path("plots", "plot", self.dataset_id, "behaviorplot", same), path)
+        for other in [
+            artifact_path("plots", "plot", self.dataset_id, "behaviorplot", dict(params, min_edge_count=2)),
+            artifact_path("plots", "plot", hash_upload("other"), "behaviorplot", params),
+            artifact_path("plots", "plot", self.dataset_id, "barplot", params),
+        ]:
+            self.assertNotEqual(other, path)
+
+    def test_existing_url(self):
+        path = artifact_path("plots", "plot", self.dataset_id, "behaviorplot", {})
+        os.makedirs("public/plots")
+        open(path + ".svg", "w").close()
+        self.assertEqual(existing_url(path + ".svg"), localhost + path + ".svg")
+        # the marker is the file saved last
+        self.assertIsNone(existing_url(path + ".svg", path + ".csv"))
+
+    def test_saved_plot_is_not_computed_again(self):
+        data = {
+            "dataset": self.dataset_id,
+            "plot_categories": "false",
+            "separate": "false",
+            "id_list": '["dummy"]',
+            "bhvr_list": '["dummy"]',
+        }
+        path = artifact_path("plots", "plot", self.dataset_id, "behaviorplot", request_params(data)) + ".svg"
+        os.makedirs("public/plots")
+        open(path, "w").close()
+        with mock.patch("functions.views.events_from_request") as events:
+            response = BehaviorPlotView.as_view()(APIRequestFactory().post("/", data))
+        self.assertEqual(response.data, {"plot": localhost + path})
+        # the dataset is not loaded
+        events.assert_not_called()
+
+
+class HeaderDetectionTests(SimpleTestCase):
+    def test_find_header_row(self):
+        rows = [["Observation id", "test"], [], ["Time", "Subject", "Behavior"], ["1.0", "a", "swim"]]
+        self.assertEqual(find_header_row(rows), 2)
+        self.assertIsNone(find_header_row(rows[:2]))
+
+    def test_csv_preamble(self):
+        df, header_row = read_upload(csv_upload(PREAMBLE + EVENTS))
+        self.assertEqual(header_row, 3)
+        self.assertEqual(list(df.columns), ["Time", "Subject", "Behavior", "Behavioral category", "Status"])
+        self.assertEqual(df.Behavior.tolist(), ["swim", "bite", "swim", "bite"])
+
+    def test_xlsx_preamble(self):
+        df, header_row = read_upload("example1")
+        self.assertEqual(header_row, 15)
+        self.assertEqual(df.columns[0], "Time")
+
+    def test_header_scan_is_bounded(self):
+        # a header after the first HEADER_SCAN_ROWS lines is not found, so the required columns are missing
+        result = ingest(csv_upload("meta,,,,\n" * HEADER_SCAN_ROWS + EVENTS))
+        self.assertIsNone(result.df)
+        self.assertIn({"row": None, "message": 'Required column "Time" is missing'}, result.errors)
+        self.assertIsNotNone(ingest(csv_upload("meta,,,,\n" * (HEADER_SCAN_ROWS - 1) + EVENTS)).df)
+
+
+class IngestTests(SimpleTestCase):
+    def test_missing_columns(self):
+        result = ingest(csv_upload("Time,Status\n1.0,START\n"))
+        self.assertIsNone(result.df)
+        self.assertEqual(
+            result.errors,
+            [
+                {"row": None, "message": 'Required column "Subject" is missing'},
+                {"row": None, "message": 'Required column "Behavior" is missing'},
+            ],
+        )
+
+    def test_error_rows(self):
+        # rows are counted from 1 like in spreadsheets, the data starts after the preamble and the header
+        text = PREAMBLE + EVENTS.replace("2.5,b,bite", "x,b,bite").replace("4.0,a,bite", "4.0,a,")
+        result = ingest(csv_upload(text))
+        self.assertIsNone(result.df)
+        self.assertEqual(
+            result.errors,
+            [
+                {"row": 8, "message": 'Column "behavior" must not have any empty cells'},
+                {"row": 6, "message": 'Column "time" must only contain numbers'},
+            ],
+        )
+
+    def test_format_errors(self):
+        errors = [{"row": row, "message": "Bad cell"} for row in range(1, 14)]
+        errors += [{"row": 5, "message": "Other cell"}, {"row": None, "message": "Bad file"}]
+        self.assertEqual(
+            format_errors(errors),
+            "Bad cell (rows 1, 2, 3, 4, 5, 6, 7, 8, 9, 10 and 3 more)\nOther cell (row 5)\nBad file\n",
+        )
+
+    def test_cleaned_dataset(self):
+        df = ingest(csv_upload(PREAMBLE + EVENTS)).df
+        self.assertEqual(df.time.tolist(), [1.0, 2.5, 3.0, 4.0])
+        self.assertEqual(df.modifier_1.unique().tolist(), ["unknown"])
+        self.assertEqual(df.total_length.unique().tolist(), [4.0])
+        self.assertIsInstance(df.behavior.dtype, pd.CategoricalDtype)
+
+    def test_aggregated_events(self):
+        df = ingest(csv_upload(AGGREGATED)).df
+        self.assertEqual(df.time.tolist(), [1.0, 2.5, 2.5, 3.0, 3.0, 6.0])
+        self.assertEqual(df.behavior.tolist(), ["swim", "bite", "bite", "swim", "rest", "rest"])
+        # simultaneous events keep the order of the file, a START before its STOP
+        self.assertEqual(df.status.tolist(), ["START", "START", "STOP", "STOP", "START", "STOP"])
+        self.assertNotIn("start_(s)", df.columns)
+
+
+class StreamingIngestTests(StoreTestCase):
+    def streamed(self, text, chunk_rows=2):
+        errors = []
+        chunks = list(iter_ingest(csv_upload(text), errors, chunk_rows=chunk_rows))
+        return chunks, errors
+
+    def assert_same_events(self, df, expected):
+        columns = ["time", "subject", "behavior", "status"]
+        self.assertEqual(df[columns].astype(str).values.tolist(), expected[columns].astype(str).values.tolist())
+
+    def test_events(self):
+        chunks, errors = self.streamed(PREAMBLE + EVENTS)
+        self.assertEqual((len(chunks), errors), (2, []))
+        self.assert_same_events(pd.concat(chunks, ignore_index=True), ingest(csv_upload(PREAMBLE + EVENTS)).df)
+
+    def test_aggregated_events_across_chunks(self):
+        # the stop of the first bout belongs after the starts of the following chunks
+        chunks, errors = self.streamed(OVERLAPPING)
+        self.assertEqual(errors, [])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertTrue(df.time.is_monotonic_increasing)
+        self.assert_same_events(df, ingest(csv_upload(OVERLAPPING)).df)
+
+    def test_errors_in_later_chunks(self):
+        text = PREAMBLE + EVENTS.replace("4.0,a,bite", "x,a,bite")
+        chunks, errors = self.streamed(text)
+        self.assertEqual(errors, [{"row": 8, "message": 'Column "time" must only contain numbers'}])
+        self.assertEqual(errors, ingest(csv_upload(text)).errors)
+
+    def test_streamed_upload(self):
+        with self.settings(INGEST_STREAMING_THRESHOLD=0):
+            dataset_id, result = ingest_upload(SimpleUploadedFile("large.csv", OVERLAPPING.encode("utf-8")))
+            # streamed datasets are not read back into memory
+            self.assertEqual(result, (None, []))
+            df = read_dataset(dataset_id)
+            self.assert_same_events(df, ingest(csv_upload(OVERLAPPING)).df)
+            self.assertEqual(df.total_length.unique().tolist(), [12.0])
+            self.assertFalse(read_bouts(dataset_id).empty)
+
+            # invalid uploads are not stored
+            dataset_id, result = ingest_upload(SimpleUploadedFile("bad.csv", b"Time,Status\n1.0,START\n"))
+            self.assertIsNone(result.df)
+            self.assertTrue(result.errors)
+            self.assertIsNone(read_dataset(dataset_id))
+
+    def test_stored_upload(self):
+        upload = SimpleUploadedFile("small.csv", (PREAMBLE + EVENTS).encode("utf-8"))
+        dataset_id, result = ingest_upload(upload)
+        self.assertEqual(len(result.df), 4)
+        self.assertTrue(dataset_path(dataset_id).startswith(self.root))
+        # an identical upload is not parsed again
+        again, result = ingest_upload(SimpleUploadedFile("copy.csv", (PREAMBLE + EVENTS).encode("utf-8")))
+        self.assertEqual((again, result), (dataset_id, (None, [])))
+
+
+class BatchUploadTests(StoreTestCase):
+    def uploads(self, *names):
+        return [SimpleUploadedFile(name, (PREAMBLE + EVENTS).encode("utf-8")) for name in names]
+
+    def test_session_names(self):
+        names = session_names(self.uploads("day1.csv", "day1.xlsx", "day2.csv", "day1.csv"))
+        self.assertEqual(names, ["day1", "day1 (2)", "day2", "day1 (3)"])
+
+    def test_sessions(self):
+        dataset_id, result = ingest_batch(self.uploads("day1.csv", "day2.csv"))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(result.df.session.value_counts().to_dict(), {"day1": 4, "day2": 4})
+        self.assertEqual(len(read_dataset(dataset_id)), 8)
+
+    def test_dataset_id(self):
+        # the same files under other names make another dataset, as the sessions are named after the files
+        first, _ = ingest_batch(self.uploads("day1.csv", "day2.csv"))
+        second, _ = ingest_batch(self.uploads("day1.csv", "day3.csv"))
+        self.assertNotEqual(first, second)
+        again, result = ingest_batch(self.uploads("day1.csv", "day2.csv"))
+        self.assertEqual(again, first)
+        self.assertEqual(result.errors, [])
+
+    def test_errors(self):
+        uploads = self.uploads("day1.csv") + [SimpleUploadedFile("day2.csv", b"Time,Status\n1.0,START\n")]
+        dataset_id, result = ingest_batch(uploads)
+        self.assertIsNone(result.df)
+        self.assertEqual(result.errors[0]["file"], "day2.csv")
+        self.assertTrue(result.errors[0]["message"].startswith("day2.csv: "))
+        self.assertIsNone(read_dataset(dataset_id))
+
+
+class ExcelTests(SimpleTestCase):
+    def test_detect_file_type(self):
+        with open(EXAMPLE_DATA["example1"], "rb") as f:
+            # the content decides, not the file name
+            xlsx = io.BytesIO(f.read())
+            xlsx.name = "upload.csv"
+        self.assertEqual(detect_file_type(xlsx), "xlsx")
+        self.assertEqual(detect_file_type(EXAMPLE_DATA["example1"]), "xlsx")
+        self.assertEqual(detect_file_type(io.BytesIO(XLSX_MAGIC + b"rest")), "xlsx")
+        self.assertEqual(detect_file_type(io.BytesIO(XLS_MAGIC + b"rest")), "xls")
+        self.assertEqual(detect_file_type(csv_upload(EVENTS)), "csv")
+        self.assertEqual(detect_file_type(io.BytesIO(b"")), "csv")
+        # the upload is not consumed
+        self.assertEqual(xlsx.tell(), 0)
+
+    def test_streamed_rows(self):
+        # streamed rows are parsed like pandas.read_excel parses the whole workbook
+        for path in EXAMPLE_DATA.values():
+            with self.subTest(path=path):
+                header_row, chunks = read_xlsx_chunks(path, chunk_rows=100)
+                expected = pd.read_excel(path, skiprows=header_row, dtype=str)
+                pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+    def test_streamed_ingest(self):
+        errors = []
+        df = pd.concat(iter_ingest(EXAMPLE_DATA["example1"], errors, chunk_rows=100), ignore_index=True)
+        expected = ingest("example1").df
+        self.assertEqual(errors, [])
+        columns = ["time", "subject", "behavior", "behavioral_category", "status"]
+        self.assertEqual(df[columns].astype(str).values.tolist(), expected[columns].astype(str).values.tolist())
+
+
+class BoutTests(SimpleTestCase):
+    def test_build_bouts(self):
+        # the k-th START of a behavior of a subject is paired with its k-th STOP
+        df = load_example("example1")
+        starts, expected = {}, []
+        for row in df.itertuples(index=False):
+            key = (str(row.subject), row.behavior)
+            if row.status == "START":
+                starts.setdefault(key, []).append(row.time)
+            elif row.status == "STOP":
+                expected.append(key + (starts[key].pop(0), row.time))
+            else:
+                expected.append(key + (row.time, row.time))
+        bouts = build_bouts(df)
+        found = zip(bouts.subject.astype(str), bouts.behavior, bouts.start, bouts.stop)
+        self.assertEqual(Counter(found), Counter(expected))
+        self.assertTrue(bouts.start.is_monotonic_increasing)
+
+    def test_unmatched_start(self):
+        df = ingest(csv_upload(EVENTS + "5.0,b,swim,locomotion,START\n")).df
+        bouts = build_bouts(df)
+        self.assertEqual(
+            list(zip(bouts.subject, bouts.behavior, bouts.start, bouts.duration)),
+            [("a", "swim", 1.0, 2.0), ("b", "bite", 2.5, 0.0), ("a", "bite", 4.0, 0.0)],
+        )
+
+
+class BehaviorTimeTests(SimpleTestCase):
+    def test_behavior_times(self):
+        bouts = build_bouts(ingest(csv_upload(EVENTS)).df)
+        times = get_behavior_times(bouts, ["a"], "behavior")
+        # behaviors of unselected subjects are listed with a total of 0
+        self.assertEqual(
+            times.astype({"behavior": str, "category": str}).values.tolist(),
+            [["swim", 2.0, 2.0, 1, "locomotion"], ["bite", 0.0, 0.0, 1, "aggression"]],
+        )
+        times = get_behavior_times(bouts, ["b"], "behavior")
+        self.assertEqual(times[["total_time", "avg_time", "count"]].values.tolist(), [[0, 0, 0], [0, 0, 1]])
+
+    def test_per_subject(self):
+        bouts = build_bouts(ingest(csv_upload(EVENTS)).df)
+        times = get_behavior_times(bouts, ["a", "b"], "behavior", per_subject=True)
+        times = times.astype({"subject": str, "behavior": str})
+        self.assertEqual(
+            times[["subject", "behavior", "total_time", "count"]].values.tolist(),
+            [["a", "swim", 2.0, 1], ["b", "bite", 0.0, 1], ["a", "bite", 0.0, 1]],
+        )
+
+    def test_example_times(self):
+        # the sums of START and STOP times, as computed before the bout table
+        df = load_example("example1")
+        ids = get_fish_ids(df)[:2]
+        times = get_behavior_times(build_bouts(df), ids, "behavior").set_index("behavior")
+        for behavior in df.behavior.dropna().unique():
+            events = df[(df.behavior == behavior) & df.subject.isin(ids)]
+            starts, stops = events[events.status == "START"], events[events.status == "STOP"]
+            with self.subTest(behavior=behavior):
+                self.assertAlmostEqual(times.total_time[behavior], stops.time.sum() - starts.time.sum())
+                self.assertEqual(times["count"][behavior], len(events[events.status != "STOP"]))
+
+
+class CentralityTests(SimpleTestCase):
+    def setUp(self):
+        centrality_cache.clear()
+        self.G = nx.DiGraph([("a", "b"), ("b", "c"), ("c", "a"), ("a", "c")])
+
+    def test_needed_centralities(self):
+        # networks with a statistics table list all centralities
+        self.assertEqual(needed_centralities(["amount", "indeg"]), list(CENTRALITIES))
+        self.assertEqual(needed_centralities(["closeness", "amount", "closeness"], statistics=False), ["closeness"])
+        self.assertEqual(needed_centralities(["amount", "avg_time"], statistics=False), [])
+
+    def test_only_requested_metrics(self):
+        table = centrality_table(self.G, ["indeg"])
+        self.assertEqual(list(table.columns), ["ID", "In-Deg.Cen."])
+        self.assertEqual(list(table.ID), list(self.G.nodes))
+        self.assertEqual(dict(zip(table.ID, table["In-Deg.Cen."])), nx.in_degree_centrality(self.G))
+        self.assertEqual(centrality_cache.stats()["entries"], 1)
+
+    def test_memoized(self):
+        centrality_table(self.G, list(CENTRALITIES))
+        # the same structure with other attributes is served from the cache
+        H = self.G.copy()
+        nx.set_edge_attributes(H, 2, name="weight")
+        table = centrality_table(H, list(CENTRALITIES))
+        self.assertEqual(centrality_cache.stats()["entries"], len(CENTRALITIES))
+        self.assertEqual(centrality_cache.stats()["hits"], len(CENTRALITIES))
+        self.assertEqual(dict(zip(table.ID, table["Between.Cen."])), nx.betweenness_centrality(self.G))
+
+
+class TransitionTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.datasets = {name: load_example(name) for name in EXAMPLE_DATA}
+
+    def test_count_transitions(self):
+        for name, df in self.datasets.items():
+            ids = get_fish_ids(df)
+            for column in ["behavior", "behavioral_category"]:
+                for id_list in [ids, ids[:1]]:
+                    with self.subTest(dataset=name, column=column, subjects=len(id_list)):
+                        expected = loop_transitions(df, id_list, column)
+                        self.assertEqual(as_counter(count_transitions(df, id_list, column)), expected)
+
+    def test_statuses(self):
+        df = ingest(csv_upload(EVENTS)).df
+        # STOP events are skipped and POINT is shown as empty status
+        self.assertEqual(
+            as_counter(count_transitions(df, ["a", "b"], "behavior")),
+            Counter({("swim", "START", "bite", ""): 1}),
+        )
+
+    def test_higher_order(self):
+        df = self.datasets["example1"]
+        ids = get_fish_ids(df)
+        for order in [2, 3]:
+            with self.subTest(order=order):
+                expected = loop_transitions(df, ids, "behavior", order)
+                self.assertEqual(as_counter(count_transitions(df, ids, "behavior", order)), expected)
+
+    def test_higher_order_states(self):
+        df = ingest(csv_upload(EVENTS.replace("2.5,b,", "2.5,a,"))).df
+        # the status of a state is the status of its last behavior
+        self.assertEqual(
+            as_counter(count_transitions(df, ["a"], "behavior", 2)),
+            Counter({("swim → bite", "", "bite → bite", ""): 1}),
+        )
+        self.assertTrue(count_transitions(df, ["a"], "behavior", 3).empty)
+
+    def test_sessions(self):
+        # transitions never span two sessions of the same subject
+        df = self.datasets["example1"]
+        sessions = merge_sessions([("a", df), ("b", df)])
+        ids = get_fish_ids(sessions)
+        single = as_counter(count_transitions(df, ids, "behavior"))
+        merged = as_counter(count_transitions(sessions, ids, "behavior"))
+        self.assertEqual(merged, loop_transitions(sessions, ids, "behavior"))
+        self.assertEqual(merged, Counter({key: 2 * value for key, value in single.items()}))
+
+    def test_windowed_transitions(self):
+        for name, df in self.datasets.items():
+            ids = get_fish_ids(df)
+            for window, step in [(60, None), (100, 30)]:
+                with self.subTest(dataset=name, window=window, step=step):
+                    windows = windowed_transitions(df, ids, "behavior", window, step)
+                    expected = loop_windows(df, ids, "behavior", windows["starts"], window)
+                    labels = windows["labels"]
+                    for counts, reference in zip(windows["counts"], expected):
+                        rows, cols = np.nonzero(counts)
+                        found = Counter({(labels[r], labels[c]): counts[r, c] for r, c in zip(rows, cols)})
+                        self.assertEqual(found, reference)
+
+
+class TransitionMatrixTests(SimpleTestCase):
+    def test_mixed_statuses(self):
+        # edges of both statuses between the same categories become one entry
+        df = ingest(csv_upload(MIXED_STATUSES)).df
+        edges_df, nodes_df = transition_tables(df, "behavioral_category", 0, False, ["dummy"], ["dummy"])
+        self.assertEqual(len(edges_df), 4)
+        matrix = transition_matrix(edges_df, nodes_df)
+        self.assertEqual(sorted(matrix["labels"]), ["aggression", "locomotion"])
+        rows, cols = matrix["labels"][matrix["row"]], matrix["labels"][matrix["col"]]
+        entries = dict(zip(zip(rows, cols), zip(matrix["count"], matrix["probability"])))
+        self.assertEqual(len(entries), len(rows))
+        self.assertEqual(entries, {("locomotion", "aggression"): (2, 1.0), ("aggression", "locomotion"): (2, 1.0)})
+
+    def test_probabilities(self):
+        df = load_example("example1")
+        edges_df, nodes_df = transition_tables(df, "behavioral_category", 0, False, ["dummy"], ["dummy"])
+        matrix = transition_matrix(edges_df, nodes_df)
+        self.assertEqual(len(set(matrix["labels"])), len(matrix["labels"]))
+        self.assertEqual(len(set(zip(matrix["row"], matrix["col"]))), len(matrix["row"]))
+        self.assertEqual(matrix["count"].sum(), edges_df.records.sum())
+        rows = np.bincount(matrix["row"], weights=matrix["probability"], minlength=len(matrix["labels"]))
+        np.testing.assert_allclose(rows[np.unique(matrix["row"])], 1)
+        # the threshold drops entries but keeps the probabilities relative to all outgoing transitions
+        kept = transition_matrix(edges_df, nodes_df, 5)
+        self.assertTrue((kept["count"] >= 5).all())
+        self.assertTrue(set(kept["probability"]) <= set(matrix["probability"]))
+
+
+class TransitionTensorTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = load_example("example1")
+        cls.tensor = transition_tensor(count_subject_transitions(cls.df, "behavior"), dense=True)
+
+    def subject_edges(self, subject):
+        # statuses are not distinguished in the tensor
+        edges_df = count_transitions(self.df, [subject], "behavior")
+        return edges_df.groupby(["action_1", "action_2"], as_index=False).records.sum()
+
+    def test_tensor(self):
+        labels = self.tensor["labels"]
+        for i, subject in enumerate(self.tensor["subjects"]):
+            with self.subTest(subject=subject):
+                values = self.tensor["tensor"][i]
+                rows, cols = np.nonzero(values)
+                found = {(labels[r], labels[c]): values[r, c] for r, c in zip(rows, cols)}
+                edges_df = self.subject_edges(subject)
+                self.assertEqual(found, dict(zip(zip(edges_df.action_1, edges_df.action_2), edges_df.records)))
+
+    def test_subject_selection(self):
+        subjects = list(self.tensor["subjects"][::-1][:2])
+        tensor = transition_tensor(count_subject_transitions(self.df, "behavior"), subjects, dense=True)
+        self.assertEqual(list(tensor["subjects"]), subjects)
+        np.testing.assert_array_equal(tensor["tensor"], self.tensor["tensor"][::-1][:2])
+
+    def test_normalized_graphs(self):
+        # weights are the unrounded frequencies of the transition networks
+        graphs = tensor_to_graphs(self.tensor, normalized=True)
+        for subject, G in graphs.items():
+            with self.subTest(subject=subject):
+                edges_df = self.subject_edges(subject)
+                expected = dict(zip(zip(edges_df.action_1, edges_df.action_2), transition_frequencies(edges_df)))
+                self.assertEqual(nx.get_edge_attributes(G, "weight"), expected)
+
+
+@override_settings(PERMUTATION_WORKERS=1)
+class PermutationTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = load_example("example1")
+        cls.ids = get_fish_ids(cls.df)
+
+    def test_observed_counts(self):
+        # transitions of any status are tested together
+        expected = Counter()
+        for (action_1, _, action_2, _), records in loop_transitions(self.df, self.ids, "behavior").items():
+            expected[(action_1, action_2)] += records
+        result = permutation_test(self.df, self.ids, "behavior", 50)
+        self.assertEqual(Counter(dict(zip(zip(result.action_1, result.action_2), result.records.tolist()))), expected)
+        self.assertTrue(((result.p_value > 0) & (result.p_value <= 1)).all())
+
+    def test_default_seed(self):
+        result = permutation_test(self.df, self.ids, "behavior", 50)
+        pd.testing.assert_frame_equal(permutation_test(self.df, self.ids, "behavior", 50, DEFAULT_SEED), result)
+        other = permutation_test(self.df, self.ids, "behavior", 50, DEFAULT_SEED + 1)
+        self.assertFalse(np.allclose(other.expected, result.expected))
+
+    def test_batches(self):
+        # smaller batches continue the same random stream
+        result = permutation_test(self.df, self.ids, "behavior", 20)
+        with mock.patch("functions.permutations.BATCH_ELEMENTS", 1):
+            pd.testing.assert_frame_equal(permutation_test(self.df, self.ids, "behavior", 20), result)
+
+    def test_batch_size(self):
+        # the counts of many codes bound the batch as well as the events
+        self.assertEqual(batch_size(10, 100), BATCH_ELEMENTS // 10000)
+        self.assertEqual(batch_size(10000, 10), BATCH_ELEMENTS // 10000)
+        self.assertEqual(batch_size(2 * BATCH_ELEMENTS, 2), 1)
+
+
+class DotTests(SimpleTestCase):
+    def test_dot_id(self):
+        self.assertEqual(dot_id("swim"), '"swim"')
+        self.assertEqual(dot_id(1.5), '"1.5"')
+        self.assertEqual(dot_id('say "hi"'), r'"say \"hi\""')
+        self.assertEqual(dot_id("a\\b"), r'"a\\b"')
+        # the backslash before a quote is escaped once and the quote once
+        self.assertEqual(dot_id('a\\"b'), r'"a\\\"b"')
+
+    def test_to_dot(self):
+        G = nx.DiGraph()
+        G.graph["node"] = {"shape": "circle"}
+        G.add_node('bite "hard"', label="bite")
+        G.add_edge('bite "hard"', "swim", penwidth=0.5)
+        self.assertEqual(dot_attributes({}), "")
+        self.assertEqual(
+            to_dot(G),
+            "digraph {\n"
+            'node [shape="circle"];\n'
+            r'"bite \"hard\"" [label="bite"];' "\n"
+            '"swim";\n'
+            r'"bite \"hard\"" -> "swim" [penwidth="0.5"];' "\n"
+            "}\n",
+        )
+
+
+class LayoutTests(SimpleTestCase):
+    def setUp(self):
+        layout_cache.clear()
+        self.addCleanup(layout_cache.clear)
+        self.G = nx.DiGraph()
+        self.G.add_node("swim", label="swim - 3", width=0.5, height=0.5, fillcolor="red", style="filled")
+        self.G.add_node("bite", label="bite - 1", width=0.3, height=0.3)
+        self.G.add_edge("swim", "bite", label="1", penwidth=2, color="red")
+
+    def test_style_keeps_key(self):
+        H = self.G.copy()
+        H.nodes["swim"]["fillcolor"] = "blue"
+        H.edges["swim", "bite"]["color"] = "blue"
+        H.edges["swim", "bite"]["penwidth"] = 4
+        self.assertEqual(layout_key(H), layout_key(self.G))
+
+    def test_geometry_changes_key(self):
+        key = layout_key(self.G)
+        changes = [
+            lambda H: H.nodes["swim"].update(label="swim - 4"),
+            lambda H: H.nodes["bite"].update(width=0.6),
+            lambda H: H.edges["swim", "bite"].update(label="2"),
+            lambda H: nx.relabel_nodes(H, {"bite": "chase"}, copy=False),
+            lambda H: H.graph.update(graph={"rankdir": "LR"}),
+        ]
+        for i, change in enumerate(changes):
+            with self.subTest(change=i):
+                H = self.G.copy()
+                change(H)
+                self.assertNotEqual(layout_key(H), key)
+
+    def test_cached_layout(self):
+        layout = {"graph": {"bb": "0,0,10,10"}, "nodes": [{}, {}], "edges": [{}]}
+        layout_cache.put(layout_key(self.G), layout)
+        H = self.G.copy()
+        H.nodes["bite"]["fillcolor"] = "green"
+        # a graph with another style is laid out like the cached one, without running graphviz
+        with mock.patch.object(render_pool, "submit") as submit:
+            self.assertEqual(graph_layout(H), layout)
+        submit.assert_not_called()
 
-# Create your tests here.
@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+
+# Transition counting on integer codes. Events are grouped by subject (and session for batch uploads)
+# with one stable sort, consecutive events of a group form a transition.
+
+TRANSITION_COLUMNS = ["action_1", "status_1", "action_2", "status_2"]
+# joins the behaviors of a state in higher order networks, e.g. "A → B"
+STATE_SEPARATOR = " → "
+
+
+def codes_and_labels(values):
+    """
+    Returns the integer codes of a column and the labels they refer to, missing values have code -1.
+
+    :param values: pandas series, categorical or not
+    :return: 2-tuple (numpy array of codes, numpy array of labels)
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories.to_numpy()
+    codes, labels = pd.factorize(values)
+    return codes, np.asarray(labels)
+
+
+def group_codes(df, keys):
+    """
+    Combines the codes of several key columns into one integer code per row.
+
+    :param df: pandas dataframe
+    :param keys: list of columns
+    :return: numpy array of group codes
+    """
+    group = np.zeros(len(df), dtype=np.int64)
+    for key in keys:
+        codes, labels = codes_and_labels(df[key])
+        group = group * (len(labels) + 1) + codes + 1
+    return group
+
+
+def sequence_positions(df, length=2):
+    """
+    Finds all sequences of consecutive events of the same subject within the same session.
+
+    :param df: events in temporal order
+    :param length: number of events per sequence
+    :return: list of length arrays, the positions of the first, second, ... event of each sequence
+    """
+    keys = ["subject"] + (["session"] if "session" in df.columns else [])
+    group = group_codes(df, keys)
+    # stable, so events keep their temporal order within a group
+    order = np.argsort(group, kind="stable")
+    n = max(len(order) - length + 1, 0)
+    # groups are contiguous after sorting, so a sequence lies in one group if its first and last event do
+    same = group[order][: n] == group[order][length - 1 : length - 1 + n]
+    return [order[i : i + n][same] for i in range(length)]
+
+
+def join_labels(labels, codes):
+    """
+    Joins the labels of several code arrays element-wise into state names.
+
+    :param labels: numpy array of labels
+    :param codes: list of code arrays
+    :return: numpy array of strings
+    """
+    if len(codes) == 1:
+        return labels[codes[0]]
+    states = pd.Series(labels[codes[0]], dtype=object).astype(str)
+    states = states.str.cat([pd.Series(labels[c], dtype=object).astype(str) for c in codes[1:]], sep=STATE_SEPARATOR)
+    return states.to_numpy()
+
+
+def count_transitions(df, id_list, column, order=1):
+    """
+    Counts how often a behavior (with its status) is followed by another for the selected subjects.
+    STOP events are ignored and the status POINT is shown as empty string.
+    For order k > 1 the states are sequences of k behaviors, e.g. "A → B", and a transition
+    "A → B" to "B → C" is counted for every observed sequence A, B, C. Only observed sequences are
+    counted, so memory grows with their number rather than with the number of possible states.
+    The status of a state is the status of its last behavior.
+
+    :param df: pandas dataframe
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :param order: number of behaviors per state
+    :return: pandas dataframe with columns action_1, status_1, action_2, status_2, tuples and records, sorted by the first four
+    """
+    events = df[(df.status != "STOP") & df.subject.isin(id_list)]
+    positions = sequence_positions(events, order + 1)
+
+    actions, action_labels = codes_and_labels(events[column])
+    statuses, status_labels = codes_and_labels(events.status)
+    action_columns = ["action_{}".format(i) for i in range(order + 1)]
+    sequences = pd.DataFrame({col: actions[pos] for col, pos in zip(action_columns, positions)})
+    sequences["status_1"] = statuses[positions[-2]]
+    sequences["status_2"] = statuses[positions[-1]]
+    # transitions from or to missing values are not counted
+    sequences = sequences[(sequences >= 0).all(axis=1)]
+    counts = sequences.groupby(action_columns + ["status_1", "status_2"]).size()
+
+    codes = counts.index.to_frame(index=False)
+    action_codes = [codes[col].to_numpy() for col in action_columns]
+    successor_df = pd.DataFrame(
+        {
+            "action_1": join_labels(action_labels, action_codes[:-1]),
+            "status_1": status_labels[codes.status_1.to_numpy()],
+            "action_2": join_labels(action_labels, action_codes[1:]),
+            "status_2": status_labels[codes.status_2.to_numpy()],
+        },
+        dtype=object,
+    )
+    successor_df = successor_df.replace(to_replace="POINT", value="")
+    successor_df["tuples"] = list(zip(successor_df.action_1, successor_df.action_2))
+    successor_df["records"] = counts.to_numpy()
+    return successor_df.sort_values(TRANSITION_COLUMNS, ignore_index=True)
+
+
+def transition_frequencies(edges_df, mode="row"):
+    """
+    Divides the transition counts by the sum over all outgoing transitions of the same behavior (row),
+    all incoming transitions of the same behavior (column) or all transitions (global).
+
+    :param edges_df: pandas dataframe with columns action_1, action_2 and records
+    :param mode: row, column or global
+    :return: pandas series of frequencies aligned with edges_df
+    """
+    if mode == "global":
+        return edges_df.records / edges_df.records.sum()
+    group = "action_2" if mode == "column" else "action_1"
+    return edges_df.records / edges_df.groupby(group).records.transform("sum")
+
+
+def threshold_edges(edges_df, min_edge_count, normalized):
+    """
+    Removes edges below a threshold on the counts, or on the frequencies in column normalized.
+
+    :param edges_df: pandas dataframe with column records and optionally normalized
+    :param min_edge_count: Threshold for edges to be kept
+    :param normalized: apply the threshold to column normalized instead of records
+    :return: pandas dataframe
+    """
+    if not min_edge_count:
+        return edges_df
+    values = edges_df.normalized if normalized else edges_df.records
+    return edges_df[values >= float(min_edge_count)]
+
+
+def transition_matrix(edges_df, nodes_df, min_edge_count=0, normalized=False, normalization_mode="row"):
+    """
+    Converts the tables of a transition network into a sparse matrix in coordinate format.
+    Rows and columns index into labels, probabilities are the counts divided by all outgoing counts of a node
+    (see transition_frequencies for other modes), also if some of its edges are dropped by the threshold.
+    Edges between the same nodes with different statuses are summed into one entry.
+
+    :param edges_df: all edges, see visualizations.transition_tables
+    :param nodes_df: nodes, see visualizations.transition_tables
+    :param min_edge_count: Threshold for edges to be kept
+    :param normalized: apply the threshold to the probabilities instead of the counts
+    :param normalization_mode: row, column or global
+    :return: dict of numpy arrays labels, row, col, count, probability and node_total_time, node_avg_time, node_record, node_category
+    """
+    # e.g. a category with point and state behaviors has edges of several statuses between the same nodes
+    edges_df = edges_df.groupby(["action_1", "action_2"], sort=False, as_index=False).records.sum()
+    labels = pd.Index(pd.unique(pd.concat([nodes_df.node, edges_df.action_1, edges_df.action_2], ignore_index=True)))
+    nodes = nodes_df.drop_duplicates("node").set_index("node").reindex(labels)
+    probability = transition_frequencies(edges_df, normalization_mode)
+    keep = threshold_edges(edges_df.assign(normalized=probability), min_edge_count, normalized).index
+    edges_df = edges_df.loc[keep]
+    return {
+        "labels": labels.to_numpy(dtype=str),
+        "row": labels.get_indexer(edges_df.action_1),
+        "col": labels.get_indexer(edges_df.action_2),
+        "count": edges_df.records.to_numpy(dtype=np.int64),
+        "probability": probability.loc[keep].to_numpy(dtype=np.float64),
+        "node_total_time": nodes.total_time.to_numpy(dtype=np.float64),
+        "node_avg_time": nodes.avg_time.to_numpy(dtype=np.float64),
+        "node_record": nodes.record.fillna(0).to_numpy(dtype=np.int64),
+        "node_category": nodes.category.astype(object).where(nodes.category.notna(), "").to_numpy(dtype=str),
+    }
+
+
+def count_subject_transitions(df, column):
+    """
+    Counts the transitions between behaviors of every subject (and session) in one grouped pass.
+    STOP events are ignored and statuses are not distinguished. Subjects and behaviors are categorical
+    with all values of the dataset as categories, so subjects without transitions are kept as well.
+
+    :param df: pandas dataframe
+    :param column: behavior or behavioral category column
+    :return: pandas dataframe with columns subject, (session,) action_1, action_2 and records
+    """
+    events = df[df.status != "STOP"]
+    first, second = sequence_positions(events)
+
+    keys = ["subject"] + (["session"] if "session" in events.columns else [])
+    key_codes = {key: codes_and_labels(events[key]) for key in keys}
+    actions, action_labels = codes_and_labels(events[column])
+    sequences = pd.DataFrame({key: codes[first] for key, (codes, _) in key_codes.items()})
+    sequences["action_1"] = actions[first]
+    sequences["action_2"] = actions[second]
+    sequences = sequences[(sequences >= 0).all(axis=1)]
+    counts = sequences.groupby(list(sequences.columns)).size().rename("records").reset_index()
+
+    for key, (_, labels) in key_codes.items():
+        counts[key] = pd.Categorical.from_codes(counts[key], categories=labels)
+    for key in ["action_1", "action_2"]:
+        counts[key] = pd.Categorical.from_codes(counts[key], categories=action_labels)
+    return counts
+
+
+def transition_tensor(counts, subjects=None, dense=False):
+    """
+    Arranges the transition counts of several subjects as a subjects × behaviors × behaviors tensor.
+    Counts of different sessions are summed up.
+
+    :param counts: pandas dataframe, see count_subject_transitions
+    :param subjects: list of subjects to include in this order, None for all
+    :param dense: also return the tensor as dense numpy array
+    :return: dict of numpy arrays subjects and labels, and the nonzero entries in coordinate format
+        subject, row, col and count (plus tensor if dense)
+    """
+    if subjects is None:
+        subjects = counts.subject.cat.categories
+    subjects = pd.Index(subjects)
+    labels = counts.action_1.cat.categories
+    counts = counts[counts.subject.isin(subjects)]
+    counts = counts.groupby(["subject", "action_1", "action_2"], observed=True).records.sum().reset_index()
+
+    tensor = {
+        "subjects": subjects.to_numpy(dtype=str),
+        "labels": labels.to_numpy(dtype=str),
+        "subject": subjects.get_indexer(counts.subject),
+        "row": counts.action_1.cat.codes.to_numpy(dtype=np.int64),
+        "col": counts.action_2.cat.codes.to_numpy(dtype=np.int64),
+        "count": counts.records.to_numpy(dtype=np.int64),
+    }
+    if dense:
+        values = np.zeros((len(subjects), len(labels), len(labels)), dtype=np.int64)
+        values[tensor["subject"], tensor["row"], tensor["col"]] = tensor["count"]
+        tensor["tensor"] = values
+    return tensor
+
+
+def windowed_transitions(df, id_list, column, window, step=None):
+    """
+    Counts the transitions between behaviors within sliding time windows [start, start + window).
+    A transition lies in a window if both of its events do. The windows slide over the transitions
+    sorted by time and the counts are updated as transitions enter and leave, instead of being
+    counted again for every window. STOP events are ignored and statuses are not distinguished.
+
+    :param df: pandas dataframe
+    :param id_list: list of selected subjects
+    :param column: behavior or behavioral category column
+    :param window: length of the windows in seconds
+    :param step: offset between consecutive windows in seconds, defaults to window (no overlap)
+    :return: dict of numpy arrays labels, starts (of the windows) and counts (windows × behaviors × behaviors)
+    """
+    step = step or window
+    events = df[(df.status != "STOP") & df.subject.isin(id_list)]
+    first, second = sequence_positions(events)
+    actions, labels = codes_and_labels(events[column])
+    times = events.time.to_numpy(dtype=np.float64)
+
+    # transitions from or to missing values are not counted, longer ones than a window never fit in one
+    keep = (actions[first] >= 0) & (actions[second] >= 0) & (times[second] - times[first] < window)
+    first, second = first[keep], second[keep]
+    rows, cols = actions[first], actions[second]
+    starts_at, ends_at = times[first], times[second]
+
+    begin = np.nanmin(times) if len(times) else 0.0
+    end = np.nanmax(times) if len(times) else 0.0
+    n_windows = max(1, int(np.ceil((end - begin - window) / step)) + 1)
+    starts = begin + step * np.arange(n_windows)
+
+    # transitions enter once their second event is before the end of the window, and leave once their first
+    # event is before its start; the latter have entered already as they are shorter than a window
+    by_end = np.argsort(ends_at, kind="stable")
+    by_start = np.argsort(starts_at, kind="stable")
+    entered = np.searchsorted(ends_at[by_end], starts + window, side="left")
+    left = np.searchsorted(starts_at[by_start], starts, side="left")
+
+    counts = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    windows = np.empty((n_windows, len(labels), len(labels)), dtype=np.int64)
+    n_entered = n_left = 0
+    for i in range(n_windows):
+        entering = by_end[n_entered : entered[i]]
+        np.add.at(counts, (rows[entering], cols[entering]), 1)
+        leaving = by_start[n_left : left[i]]
+        np.subtract.at(counts, (rows[leaving], cols[leaving]), 1)
+        n_entered, n_left = entered[i], left[i]
+        windows[i] = counts
+    return {"labels": np.asarray(labels).astype(str), "starts": starts, "counts": windows}
@@ -4,11 +4,16 @@ from . import views
 # reachable APIs, each is handling a request for calculation or information from the frontend
 urlpatterns = [
     path('upload/', views.UploadView.as_view()),
+    path('upload-batch/', views.BatchUploadView.as_view()),
     path('infos/', views.InfoView.as_view()),
     path('interactions/', views.InteractionView.as_view()),
     path('behaviorplot/', views.BehaviorPlotView.as_view()),
     path('barplot/', views.BarplotView.as_view()),
     path('timeseries/', views.TimeSeriesView.as_view()),
     path('transitions/', views.TransitionView.as_view()),
+    path('transitions/matrix/', views.TransitionMatrixView.as_view()),
+    path('transitions/tensor/', views.TransitionTensorView.as_view()),
+    path('transitions/windows/', views.TransitionWindowView.as_view()),
     path('distances/', views.DistanceView.as_view()),
+    path('cache/', views.CacheView.as_view()),
 ]
@@ -1,10 +1,29 @@
+import io
 import json
+import os
 import natsort
+import numpy as np
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .visualizations import *
 from .comparisons import *
 from .helpers import *
+from .artifacts import artifact_path, existing_url, request_params, save_json
+from .cache import dataset_cache
+from .datasets import (
+    bouts_from_request,
+    dataset_from_request,
+    dataset_id_from_request,
+    events_from_request,
+    ingest_batch,
+    ingest_upload,
+    transition_counts_from_request,
+    transition_tables_from_request,
+)
+from .ingest import format_errors
+from .permutations import DEFAULT_SEED
+from .transitions import transition_matrix, transition_tensor, windowed_transitions
 import pandas as pd
 
 # All views are simple request/response constructs, taking
@@ -13,26 +32,57 @@ import pandas as pd
 
 class UploadView(APIView):
     def post(self, request, *args, **kwargs):
-        response, success = try_upload(self.request.data["upload"])
-        return Response(status=200, data={"success": success, "response": response})
+        # validate and clean the upload in one pass, the cleaned dataset is stored
+        # and subsequent requests only send its id
+        dataset_id, result = ingest_upload(self.request.data["upload"])
+        success = not result.errors
+        return_data = {
+            "success": success,
+            "response": format_errors(result.errors),
+            "errors": result.errors,
+        }
+        if success:
+            return_data["dataset"] = dataset_id
+        return Response(status=200, data=return_data)
+
+
+class BatchUploadView(APIView):
+    def post(self, request, *args, **kwargs):
+        # one file per recording session, merged into a single dataset with column session
+        uploads = self.request.FILES.getlist("uploads")
+        if not uploads:
+            return Response(status=400)
+        dataset_id, result = ingest_batch(uploads)
+        success = not result.errors
+        return_data = {
+            "success": success,
+            "response": format_errors(result.errors),
+            "errors": result.errors,
+        }
+        if success:
+            return_data["dataset"] = dataset_id
+            return_data["sessions"] = get_sessions(result.df)
+        return Response(status=200, data=return_data)
 
 
 class InfoView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        dataset_id, data = dataset_from_request(self.request.data)
+        if data is None:
+            return Response(status=404)
         headers = data.columns.tolist()
         ids = get_fish_ids(data)
         modifier_1s = get_unique_modifier1s(data)
         behaviors = natsort.natsorted(data.behavior.unique().tolist())
         categories = natsort.natsorted(data.behavioral_category.unique().tolist())
+        sessions = get_sessions(data)
         return_data = {
             "headers": headers,
             "ids": ids,
             "modifier_1s": modifier_1s,
             "behaviors": behaviors,
             "categories": categories,
+            "sessions": sessions,
         }
 
         return Response(status=200, data=return_data)
@@ -40,9 +90,10 @@ class InfoView(APIView):
 
 class InteractionView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        # the dataset is only loaded if the network is not saved yet
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
         # Load json stringified arrays
         id_list = json.loads(self.request.POST.get("id_list", None))
         mod1_list = json.loads(self.request.POST.get("mod1_list", None))
@@ -50,57 +101,104 @@ class InteractionView(APIView):
         hue = json.loads(self.request.data["color_hue"])
         node_color_map = self.request.data["node_color_map"]
         node_size_map = self.request.data["node_size_map"]
+        coordinates = json.loads(self.request.data.get("coordinates", "false"))
 
-        return_data = {
-            "graph": interaction_network(data, id_list, mod1_list,hue, node_color_map, node_size_map, min_edge_count)
-        }
+        # output "json" returns the network for rendering on the client, without rendering or writing files
+        if self.request.data.get("output", "image") == "json":
+            data = events_from_request(dataset_id, self.request.data)
+            if data is None:
+                return Response(status=404)
+            network = interaction_network(
+                data, id_list, mod1_list, hue, node_color_map, node_size_map, min_edge_count, None, "json", coordinates
+            )
+            return Response(status=200, data={"network": network})
+
+        # identical requests are answered with the saved files
+        path = artifact_path("interactions", "interactions", dataset_id, "interactions", request_params(self.request.data))
+        graph = existing_url(path + ".gv.svg", path + ".gml")
+        if graph is None:
+            data = events_from_request(dataset_id, self.request.data)
+            if data is None:
+                return Response(status=404)
+            graph = interaction_network(data, id_list, mod1_list,hue, node_color_map, node_size_map, min_edge_count, path)
+
+        return_data = {"graph": graph}
         return Response(status=200, data=return_data)
 
 
 class BehaviorPlotView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        # the dataset is only loaded if the plot is not saved yet
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
         plot_categories = json.loads(self.request.data["plot_categories"])
         separate = json.loads(self.request.data["separate"])
         # Load json stringified arrays
         id_list = json.loads(self.request.POST.get("id_list", None))
         bhvr_list = json.loads(self.request.POST.get("bhvr_list", None))
-        return_data = {"plot": dataplot(data, plot_categories, id_list, bhvr_list, separate)}
+        # identical requests are answered with the saved image
+        path = artifact_path("plots", "plot", dataset_id, "behaviorplot", request_params(self.request.data)) + ".svg"
+        plot = existing_url(path)
+        if plot is None:
+            data = events_from_request(dataset_id, self.request.data)
+            if data is None:
+                return Response(status=404)
+            plot = dataplot(data, plot_categories, id_list, bhvr_list, separate, path)
+        return_data = {"plot": plot}
         return Response(status=200, data=return_data)
     
 class BarplotView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        # the dataset is only loaded if the plot is not saved yet
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
         
         plot_categories = json.loads(self.request.data["plot_categories"])
         plot_total_time = json.loads(self.request.data["plot_total_time"])
         relative = json.loads(self.request.data["relative"])
         id_list = json.loads(self.request.POST.get("id_list", None))
         bhvr_list = json.loads(self.request.POST.get("bhvr_list", None))
-        return_data = {"plot": barplot(data, id_list, bhvr_list, plot_categories, relative, plot_total_time)}
+        # identical requests are answered with the saved image
+        path = artifact_path("barplots", "barplot", dataset_id, "barplot", request_params(self.request.data)) + ".svg"
+        plot = existing_url(path)
+        if plot is None:
+            data = events_from_request(dataset_id, self.request.data)
+            if data is None:
+                return Response(status=404)
+            bouts = bouts_from_request(dataset_id, self.request.data)
+            plot = barplot(data, id_list, bhvr_list, plot_categories, relative, plot_total_time, bouts, path)
+        return_data = {"plot": plot}
         return Response(status=200, data=return_data)
     
 
 class TimeSeriesView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        # the dataset is only loaded if the plot is not saved yet
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
         plot_categories = json.loads(self.request.data["plot_categories"])
         subject_id = json.loads(self.request.POST.get("id_list", None))[0]
         bhvr_list = json.loads(self.request.POST.get("bhvr_list", None))
-        return_data = {"plot": time_series(data,subject_id, bhvr_list, plot_categories)}
+        # identical requests are answered with the saved image
+        path = artifact_path("timeseries", "timeseries", dataset_id, "timeseries", request_params(self.request.data)) + ".svg"
+        plot = existing_url(path)
+        if plot is None:
+            data = events_from_request(dataset_id, self.request.data)
+            if data is None:
+                return Response(status=404)
+            bouts = bouts_from_request(dataset_id, self.request.data)
+            plot = time_series(data,subject_id, bhvr_list, plot_categories, bouts, path)
+        return_data = {"plot": plot}
         return Response(status=200, data=return_data)
     
 
 class DistanceView(APIView):
     def post(self, request, *args, **kwargs):
         # read input params
-        list_A = json.loads(self.request.POST.get("groupA", None))
+        list_A = json.loads(self.request.POST.get("groupA", "[]"))
         distance_alg = self.request.data["distanceAlg"]
         setindices = json.loads(self.request.data["setindices"])
 
@@ -112,44 +210,162 @@ class DistanceView(APIView):
         linkage = self.request.data["linkage"]
         color_threshold = float(self.request.data["color_threshold"])
 
-        # get pairwise distances
-        dists_edge_list = distances(list_A, distance_alg)
+        # identical requests are answered with the saved results
+        path = artifact_path(
+            "comparisons", "comparisons", self.request.data.get("dataset"), "distances", request_params(self.request.data)
+        )
+        if os.path.exists(path + ".json"):
+            with open(path + ".json") as f:
+                return Response(status=200, data=json.load(f))
+
+        # get pairwise distances, either between the subjects of a dataset or between saved networks
+        if "dataset" in self.request.data:
+            option = "behavior"
+            if self.request.data.get("option", "false") != "false":
+                option = "behavioral_category"
+            counts = transition_counts_from_request(self.request.data["dataset"], self.request.data, option)
+            if counts is None:
+                return Response(status=404)
+            subjects = None
+            if "id_list" in self.request.data:
+                id_list = json.loads(self.request.data["id_list"])
+                if "dummy" not in id_list:
+                    subjects = id_list
+            normalized = json.loads(self.request.data.get("normalized", "false"))
+            graphs = tensor_to_graphs(transition_tensor(counts, subjects), normalized)
+            dists_edge_list = graph_distances(graphs, distance_alg)
+        else:
+            dists_edge_list = distances(list_A, distance_alg)
 
         # Convert the edgelist to a distance matrix
         dist_matrix, node_dict = edgelist_to_dist_matrix(dists_edge_list)
 
         # cluster distances and return image url
         image_url, labels = mds(
-            dist_matrix, node_dict, distance_alg, random_state, n_init, setindices
+            dist_matrix, node_dict, distance_alg, random_state, n_init, setindices, path + "-mds.svg"
         )
         
         image2_url = hierarchical_cluster(
-            dist_matrix, node_dict, distance_alg, linkage, setindices, color_threshold
+            dist_matrix, node_dict, distance_alg, linkage, setindices, color_threshold, path + "-dendrogram.svg"
         )
         """image3_url,image4_url,image5_url = create_graph(
             dist_matrix, node_dict, distance_alg, setindices
         ) """
 
-        return Response(
-            status=200,
-            data={
-                "image_url": image_url,
-                "image2_url": image2_url,
-                #"image3_url": image3_url,
-                #"image4_url": image4_url,
-                #"image5_url": image5_url,
-                "dist_matrix": json.dumps(dist_matrix),
-                "node_dict": json.dumps(node_dict),
-                "labels": json.dumps(labels),
-            },
-        )
+        return_data = {
+            "image_url": image_url,
+            "image2_url": image2_url,
+            #"image3_url": image3_url,
+            #"image4_url": image4_url,
+            #"image5_url": image5_url,
+            "dist_matrix": json.dumps(dist_matrix),
+            "node_dict": json.dumps(node_dict),
+            "labels": json.dumps(labels),
+        }
+        # saved last, so it only exists once the images do
+        save_json(return_data, path + ".json")
+
+        return Response(status=200, data=return_data)
+
+
+class TransitionTensorView(APIView):
+    def post(self, request, *args, **kwargs):
+        # transition counts of every subject, counted once per dataset and returned without rendering
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
+        option = "behavior"
+        if self.request.data.get("option", "false") != "false":
+            option = "behavioral_category"
+        counts = transition_counts_from_request(dataset_id, self.request.data, option)
+        if counts is None:
+            return Response(status=404)
+
+        subjects = None
+        if "id_list" in self.request.data:
+            id_list = json.loads(self.request.data["id_list"])
+            if "dummy" not in id_list:
+                subjects = id_list
+        dense = json.loads(self.request.data.get("dense", "false"))
+        tensor = transition_tensor(counts, subjects, dense)
+
+        # output "npz" returns the arrays as numpy archive, otherwise json
+        if self.request.data.get("output", "json") == "npz":
+            buffer = io.BytesIO()
+            np.savez(buffer, **tensor)
+            response = HttpResponse(buffer.getvalue(), content_type="application/octet-stream")
+            response["Content-Disposition"] = 'attachment; filename="transitions.npz"'
+            return response
+
+        return_data = {key: value.tolist() for key, value in tensor.items()}
+        return_data["shape"] = [len(tensor["subjects"]), len(tensor["labels"]), len(tensor["labels"])]
+        return Response(status=200, data=return_data)
+
+
+class TransitionWindowView(APIView):
+    def post(self, request, *args, **kwargs):
+        # transition counts in sliding time windows, optionally rendered as one network per window
+        dataset_id, data = dataset_from_request(self.request.data)
+        if data is None:
+            return Response(status=404)
+
+        option = "behavior"
+        if self.request.data.get("option", "false") != "false":
+            option = "behavioral_category"
+        id_list = ["dummy"]
+        bhvr_list = ["dummy"]
+        window = 300
+        step = None
+        frames = False
+        if "id_list" in self.request.data:
+            id_list = json.loads(self.request.data["id_list"])
+        if "bhvr_list" in self.request.data:
+            bhvr_list = json.loads(self.request.data["bhvr_list"])
+        if "window" in self.request.data:
+            window = float(json.loads(self.request.data["window"]))
+        if "step" in self.request.data:
+            step = float(json.loads(self.request.data["step"]))
+        if "frames" in self.request.data:
+            frames = json.loads(self.request.data["frames"])
+        if window <= 0 or (step is not None and step <= 0):
+            return Response(status=400)
+
+        if "dummy" in id_list:
+            id_list = get_fish_ids(data)
+        if "dummy" not in bhvr_list:
+            data = data[data[option].isin(bhvr_list)]
+        windows = windowed_transitions(data, id_list, option, window, step)
+
+        # output "npz" returns the arrays as numpy archive, otherwise json
+        if self.request.data.get("output", "json") == "npz":
+            buffer = io.BytesIO()
+            np.savez(buffer, **windows)
+            response = HttpResponse(buffer.getvalue(), content_type="application/octet-stream")
+            response["Content-Disposition"] = 'attachment; filename="transitions.npz"'
+            return response
+
+        return_data = {key: value.tolist() for key, value in windows.items()}
+        if frames:
+            # identical requests are answered with the saved frames
+            path = artifact_path("transitions", "frames", dataset_id, "transitions-windows", request_params(self.request.data))
+            urls = [existing_url(path + "-frame-" + str(i) + ".gv.svg") for i in range(len(windows["starts"]))]
+            if None in urls:
+                urls = transition_frames(windows, path=path)
+            return_data["frames"] = urls
+        return Response(status=200, data=return_data)
+
+
+class CacheView(APIView):
+    def get(self, request, *args, **kwargs):
+        return Response(status=200, data=dataset_cache.stats())
 
 
 class TransitionView(APIView):
     def post(self, request, *args, **kwargs):
-        data = handle_upload(self.request.data["upload"])
-        if data is False:
-            return Response(status=204)
+        # the dataset is only loaded if its tables are not cached
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
 
         # init empty vars
         min_edge_count = 0
@@ -166,6 +382,12 @@ class TransitionView(APIView):
         custom_edge_thickness = False
         logarithmic_normalization = False
         for_comparison = False
+        order = 1
+        normalization_mode = "row"
+        permutations = 0
+        random_state = DEFAULT_SEED
+        output = "image"
+        coordinates = False
 
         # set customizations if present
         if "option" in self.request.data:
@@ -209,28 +431,128 @@ class TransitionView(APIView):
             custom_edge_thickness = json.loads(
                 self.request.data["custom_edge_thickness"]
             )
+        if "order" in self.request.data:
+            order = max(1, int(json.loads(self.request.data["order"])))
+        if "normalization_mode" in self.request.data:
+            normalization_mode = self.request.data["normalization_mode"]
+        if "permutations" in self.request.data:
+            permutations = max(0, int(json.loads(self.request.data["permutations"])))
+        if "random_state" in self.request.data:
+            random_state = json.loads(self.request.data["random_state"])
+        if "output" in self.request.data:
+            output = self.request.data["output"]
+        if "coordinates" in self.request.data:
+            coordinates = json.loads(self.request.data["coordinates"])
+        # identical requests are answered with the saved files, unless they test against unseeded permutations
+        # output "json" returns the network for rendering on the client, nothing is rendered or saved
+        path = None
+        if output != "json" and not (permutations and random_state is None):
+            path = artifact_path("transitions", "transitions", dataset_id, "transitions", request_params(self.request.data))
+            # the file saved last, networks for comparison have no statistics table
+            if permutations and order == 1:
+                marker = path + "-edge-statistics.csv"
+            else:
+                marker = path + (".gml" if for_comparison else "-statistics.csv")
+            graph = existing_url(path + ".gv.svg", marker)
+            if graph is not None:
+                return Response(status=200, data={"graph": graph})
         try:
-            return_data = {
-                "graph": transition_network(
-                    data,
-                    option,
-                    min_edge_count,
-                    with_status,
-                    normalized,
-                    colored,
-                    colored_edge_thickness,
-                    color_hue,
-                    node_color_map,
-                    node_size_map,
-                    node_label_map,
-                    id_list,
-                    bhvr_list,
-                    custom_edge_thickness,
-                    logarithmic_normalization,
-                    for_comparison
-                )
-            }
+            # counted tables are cached, changes of the appearance only re-render
+            edges_df, nodes_df, category_colors = transition_tables_from_request(
+                dataset_id,
+                self.request.data,
+                option,
+                min_edge_count,
+                normalized,
+                id_list,
+                bhvr_list,
+                order,
+                normalization_mode,
+                permutations,
+                random_state,
+            )
+            network = transition_network(
+                None,
+                option,
+                min_edge_count,
+                with_status,
+                normalized,
+                colored,
+                colored_edge_thickness,
+                color_hue,
+                node_color_map,
+                node_size_map,
+                node_label_map,
+                id_list,
+                bhvr_list,
+                custom_edge_thickness,
+                logarithmic_normalization,
+                for_comparison,
+                None,
+                order,
+                normalization_mode,
+                permutations,
+                random_state,
+                (edges_df, nodes_df),
+                path,
+                output,
+                coordinates,
+                category_colors,
+            )
+            return_data = {"network": network} if output == "json" else {"graph": network}
         except:
             return_data = {"graph": ""}
 
         return Response(status=200, data=return_data)
+
+
+class TransitionMatrixView(APIView):
+    def post(self, request, *args, **kwargs):
+        # same counts as TransitionView, but returned as numbers without rendering or writing files,
+        # the dataset is only loaded if its tables are not cached
+        dataset_id = dataset_id_from_request(self.request.data)
+        if dataset_id is None:
+            return Response(status=404)
+
+        option = "behavior"
+        if self.request.data.get("option", "false") != "false":
+            option = "behavioral_category"
+        min_edge_count = 0
+        normalized = False
+        id_list = ["dummy"]
+        bhvr_list = ["dummy"]
+        order = 1
+        normalization_mode = "row"
+        if "min_edge_count" in self.request.data:
+            min_edge_count = json.loads(self.request.data["min_edge_count"])
+        if "normalized" in self.request.data:
+            normalized = json.loads(self.request.data["normalized"])
+        if "id_list" in self.request.data:
+            id_list = json.loads(self.request.data["id_list"])
+        if "bhvr_list" in self.request.data:
+            bhvr_list = json.loads(self.request.data["bhvr_list"])
+        if "order" in self.request.data:
+            order = max(1, int(json.loads(self.request.data["order"])))
+        if "normalization_mode" in self.request.data:
+            normalization_mode = self.request.data["normalization_mode"]
+
+        # the threshold is applied to the matrix, so probabilities refer to all outgoing transitions
+        edges_df, nodes_df, _ = transition_tables_from_request(
+            dataset_id, self.request.data, option, 0, False, id_list, bhvr_list, order
+        )
+        matrix = transition_matrix(edges_df, nodes_df, min_edge_count, normalized, normalization_mode)
+
+        # output "npz" returns the arrays as numpy archive, otherwise json
+        if self.request.data.get("output", "json") == "npz":
+            buffer = io.BytesIO()
+            np.savez(buffer, **matrix)
+            response = HttpResponse(buffer.getvalue(), content_type="application/octet-stream")
+            response["Content-Disposition"] = 'attachment; filename="transitions.npz"'
+            return response
+
+        return_data = {key: value.tolist() for key, value in matrix.items()}
+        # json has no NaN, nodes without time get null
+        for key in ["node_total_time", "node_avg_time"]:
+            return_data[key] = [None if np.isnan(x) else x for x in return_data[key]]
+        return_data["shape"] = [len(matrix["labels"]), len(matrix["labels"])]
+        return Response(status=200, data=return_data)
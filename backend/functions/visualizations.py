@@ -1,26 +1,34 @@
-from networkx.drawing.nx_pydot import to_pydot
-import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.figure import Figure
 import numpy as np
-import graphviz
 import networkx as nx
 import pandas as pd
 import uuid
 import math
 import warnings
 from .helpers import *
+from .graphstats import centrality_table, needed_centralities
+from .permutations import DEFAULT_SEED, permutation_test
+from .artifacts import save_figure
+from .rendering import graph_json, render_graph
+from .ingest import build_bouts
+from .transitions import STATE_SEPARATOR, count_transitions, threshold_edges, transition_frequencies
 
 # ignore warnings if dataframe values are accessed by df["x"] instead of df.x
 warnings.simplefilter(action="ignore", category=FutureWarning)
 pd.options.mode.chained_assignment = None
 # use Agg for image generation, it runs better on the backend server
 matplotlib.use("Agg")
+# plots are drawn on their own Figure objects instead of the global pyplot state,
+# so concurrent requests can render them in parallel threads
 
 # django localhost to save images
 localhost = "http://127.0.0.1:8000/"
 
 
-def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, threshold=1):
+def interaction_network(
+    df, id_list, mod1_list, hue, node_color, node_size, threshold=1, path=None, output="image", coordinates=False
+):
     """
     The interaction network displays the number and direction of interactions between individuals.
     It is a directed weighted network where edges are drawn from individual A to individual B if A is
@@ -35,7 +43,10 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
     :param node_color_map: map x \in [total time, average time, count of occurences] to node color saturation
     :param node_size_map: map x \in [total time, average time, count of occurences] to node size
     :param threshold: Threshold for edges to be displayed
-    :return: URL where the generated image resides
+    :param path: location of the saved files without extension, a new random name if not given
+    :param output: "image" renders and saves the network, "json" returns it without writing any file
+    :param coordinates: add graphviz node and edge positions to the json output
+    :return: URL where the generated image resides, or the network as dict, see rendering.graph_json
     """
     print( hue, node_color, node_size)
 
@@ -52,7 +63,7 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
         interactions_df = interactions_df[interactions_df.modifier_1.isin(mod1_list)]
 
     # Create a dataframe for the edges
-    edges_df = interactions_df.groupby(["subject", "modifier_1"]).size().reset_index(name="records")
+    edges_df = interactions_df.groupby(["subject", "modifier_1"], observed=True).size().reset_index(name="records")
 
     # Remove edges below the threshold
     edges_df = edges_df[edges_df.records >= threshold]
@@ -67,9 +78,6 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
     # Create directed graph with networkx
     G = nx.DiGraph()
     G.add_edges_from(edges_df.tuples)
-    
-    #path = f"public/interactions/interactions-{uuid.uuid4().hex}"
-    path = f"public/interactions/interactions-{uuid.uuid4().hex}"
 
     # Edge labels and weights
     edge_attributes_label = dict(zip(edges_df.tuples, edges_df.records))
@@ -80,52 +88,20 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
     nx.set_edge_attributes(G, edge_attributes_weight, name="penwidth")
 
     # Create a DataFrame with ingoing and outgoing edges count and sum of edge labels for each ID
-    node_data = []
-    for node in G.nodes:
-        ingoing_edges = G.in_edges(node, data=True)
-        outgoing_edges = G.out_edges(node, data=True)
-
-        ingoing_count = len(ingoing_edges)
-        outgoing_count = len(outgoing_edges)
-        ingoing_label_sum = sum(edge[2]['label'] for edge in ingoing_edges )
-        outgoing_label_sum = sum(edge[2]['label'] for edge in outgoing_edges )
-        
-        # Calculate centrality measures
-        in_centrality = nx.in_degree_centrality(G).get(node, 0)
-        out_centrality = nx.out_degree_centrality(G).get(node, 0)
-        total_centrality = nx.degree_centrality(G).get(node, 0)
-        
-        # Calculate additional centrality measures
-        closeness_centrality = nx.closeness_centrality(G).get(node, 0)
-        betweenness_centrality = nx.betweenness_centrality(G).get(node, 0)
-
-        
-        # Calculate additional centrality measures with inverse edge label as weight
-        closeness_centrality_w_inv = nx.closeness_centrality(G, distance='label_inv').get(node, 0)
-        betweenness_centrality_w_inv = nx.betweenness_centrality(G, weight='label_inv').get(node, 0)
-
-
-        
-        node_data.append({
-            'ID': node,
-            '#Ingoing': ingoing_label_sum,
-            '#Outgoing': outgoing_label_sum,
-            '#IngoingEdges': ingoing_count,
-            '#OutgoingEdges': outgoing_count,
-            'In-Deg.Cen.': in_centrality,
-            'Out-Deg.Cen.': out_centrality,
-            #'TotalCentrality': total_centrality,
-            'Closen.Cen.': closeness_centrality,
-            #'ClosenessCentrality incl. e.w. ': closeness_centrality_w_inv,
-            'Between.Cen.': betweenness_centrality,
-            #'BetweennessCentrality incl .e.w.': betweenness_centrality_w_inv,
-        })
-
-    statistics_df = pd.DataFrame(node_data)
+    statistics_df = pd.DataFrame(
+        {
+            "ID": list(G.nodes),
+            "#Ingoing": [G.in_degree(node, weight="label") for node in G.nodes],
+            "#Outgoing": [G.out_degree(node, weight="label") for node in G.nodes],
+            "#IngoingEdges": [G.in_degree(node) for node in G.nodes],
+            "#OutgoingEdges": [G.out_degree(node) for node in G.nodes],
+        }
+    )
+    # each centrality once for the whole graph, the statistics table shown with the network lists all of them
+    metrics = needed_centralities([node_size, node_color])
+    statistics_df = statistics_df.merge(centrality_table(G, metrics), on="ID", how="left")
     # Sort the DataFrame alphanumerically by the 'ID' column
     statistics_sorted = statistics_df.sort_values(by='ID', key=lambda x: x.map(alphanum_key))
-    # Save the DataFrame to CSV
-    statistics_sorted.to_csv(path + "-statistics.csv", index=False)
     
     # Map centralities to node size or color
     area_max = 0.2
@@ -158,14 +134,19 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
         nodes_color = dict(zip(statistics_df['ID'], statistics_df.color))
         nx.set_node_attributes(G, nodes_color, name="fillcolor")
         nx.set_node_attributes(G, "filled", name="style")
-        
-    # Generate graphviz
-    G_dot_string = to_pydot(G).to_string()
-    G_dot = graphviz.Source(G_dot_string)
-    G_dot.format = "svg"
 
-    # Save image
-    G_dot.render(path + ".gv", view=False)
+    # the client renders the network itself
+    if output == "json":
+        return graph_json(G, coordinates, statistics_sorted)
+
+    #path = f"public/interactions/interactions-{uuid.uuid4().hex}"
+    if path is None:
+        path = f"public/interactions/interactions-{uuid.uuid4().hex}"
+    # Save the DataFrame to CSV
+    statistics_sorted.to_csv(path + "-statistics.csv", index=False)
+
+    # Save graphviz source and image
+    render_graph(G, path)
 
     # Save graph as .gml
     nx.write_gml(G, path + ".gml")
@@ -176,7 +157,7 @@ def interaction_network(df, id_list, mod1_list, hue, node_color, node_size, thre
     
     return url
 
-def dataplot(df, plot_categories, id_list, bhvr_list, separate):
+def dataplot(df, plot_categories, id_list, bhvr_list, separate, path=None):
     """
     The behavior graph displays the temporal occurrences of behavioral events.
     It maps values from the column Time to the x axis and the cumulative count of behaviors shown
@@ -189,6 +170,7 @@ def dataplot(df, plot_categories, id_list, bhvr_list, separate):
     :param id_list: list of selected subjects
     :param bhvr_list: list of selected behaviors
     :param cumulative: accumulate different behaviors for one individual
+    :param path: where the svg image is saved, a new random name if not given
     """
 
     # Only use Starting behaviors to not double count
@@ -210,13 +192,12 @@ def dataplot(df, plot_categories, id_list, bhvr_list, separate):
         df = df[df.selected.isin(bhvr_list)]
 
     # Init empty figure for the plot
-    plt.close("all")
-    fig = plt.figure(3, figsize=(15,8))
+    fig = Figure(figsize=(15,8))
     ax = fig.subplots()
     highest_plot = 0
     plot_counter = 0
 
-    plt.gca().set_prop_cycle(None)
+    ax.set_prop_cycle(None)
     # loop over all fish_ids and plot their amount of selected interactions
     for fish in id_list:
         if (plot_counter >= 10):
@@ -241,9 +222,9 @@ def dataplot(df, plot_categories, id_list, bhvr_list, separate):
                 
                 if len(sum_of_rows) > 0:
                     plot_counter += 1
-                    line_color = plt.gca()._get_lines.get_next_color()
-                    plt.plot([x[0], x[0]], [0, 1], color=line_color)
-                    plt.plot(x, y, label=f"{fish} - {behvr}", color=line_color)
+                    line_color = ax._get_lines.get_next_color()
+                    ax.plot([x[0], x[0]], [0, 1], color=line_color)
+                    ax.plot(x, y, label=f"{fish} - {behvr}", color=line_color)
                     
         elif(separate==False):
             #if (plot_counter >= 10):
@@ -259,34 +240,34 @@ def dataplot(df, plot_categories, id_list, bhvr_list, separate):
             
             if len(sum_of_rows) > 0:
                 plot_counter += 1
-                line_color = plt.gca()._get_lines.get_next_color()
-                plt.plot([x[0], x[0]], [0, 1], color=line_color)
-                plt.plot(x, y, label=fish, color=line_color)
+                line_color = ax._get_lines.get_next_color()
+                ax.plot([x[0], x[0]], [0, 1], color=line_color)
+                ax.plot(x, y, label=fish, color=line_color)
                 
     # add legend and edge labels
     # Place the legend to the right and adjust the layout
-    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
-    #plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
-    plt.xlabel("Time (s)", fontsize=18, labelpad=10)
-    plt.ylabel("Count of behavioral categories" if plot_categories else "Count of behaviors", fontsize=18, labelpad=10)
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    #ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    ax.set_xlabel("Time (s)", fontsize=18, labelpad=10)
+    ax.set_ylabel("Count of behavioral categories" if plot_categories else "Count of behaviors", fontsize=18, labelpad=10)
 
     ytick_frequency = determine_ytick_frequency(highest_plot)
     yticks = range(0, highest_plot, ytick_frequency)
 
-    plt.yticks(yticks)
-    plt.grid(linestyle="-", linewidth=0.2)
+    ax.set_yticks(yticks)
+    ax.grid(linestyle="-", linewidth=0.2)
 
     # save image
-    path = "public/plots/plot-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
-    plt.close(fig)
+    if path is None:
+        path = "public/plots/plot-" + uuid.uuid4().hex + ".svg"
+    save_figure(fig, path)
 
     # return url where image resides
     url = localhost + path
 
     return url
 
-def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_total_time=False):
+def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_total_time=False, bouts=None, path=None):
     """
     The bar plot displays the count of occurrences for each distinct value in df['selected'] for a specific individual.
     
@@ -297,6 +278,8 @@ def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_
     :param plot_categories: If True, use behavioral categories instead of behaviors as x-values
     :param relative: If True, normalize the bar heights to represent relative frequencies
     :param plot_total_time: If True, use total time as y-values
+    :param bouts: bout table of df, built from df if not given
+    :param path: where the svg image is saved, a new random name if not given
     """
 
     # Only use Starting behaviors to not double count if the records should be displayed
@@ -322,12 +305,22 @@ def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_
     if "dummy" not in bhvr_list:
         individual_df = individual_df[individual_df.selected.isin(bhvr_list)]
 
+    # Sum up the durations of the selected bouts
+    if plot_total_time:
+        if bouts is None:
+            bouts = build_bouts(df)
+        column = "behavioral_category" if plot_categories else "behavior"
+        durations = get_behavior_times(bouts, id_list, column).set_index(column).total_time
+        if "dummy" not in bhvr_list:
+            durations = durations[durations.index.isin(bhvr_list)]
+    else:
+        counts = individual_df.selected.value_counts()
+
     # Init empty figure for the plot
-    plt.close("all")
-    fig = plt.figure(1, figsize=(10,8))
+    fig = Figure(figsize=(10,8))
     ax = fig.subplots()
 
-    plt.gca().set_prop_cycle(None)
+    ax.set_prop_cycle(None)
 
     # Initialize lists to hold values and labels for the pie chart
     pie_values = []
@@ -341,16 +334,14 @@ def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_
     total_area = fig_width * fig_height
 
     # Calculate total count for relative frequencies
-    total_count = len(individual_df) if not plot_total_time else individual_df[individual_df.status == "STOP"].time.sum() - individual_df[individual_df.status == "START"].time.sum()
+    total_count = len(individual_df) if not plot_total_time else durations.sum()
 
     # Loop over all distinct values in df['selected'] (e.g., df['behavior'])
     for i, value in enumerate(sorted(individual_df['selected'].unique())):
         if plot_total_time:
-            stop_total = individual_df[(individual_df.status == "STOP") & (individual_df['selected'] == value)].time.sum()
-            start_total = individual_df[(individual_df.status == "START") & (individual_df['selected'] == value)].time.sum()
-            count = stop_total - start_total
+            count = durations.get(value, 0)
         else:
-            count = individual_df[individual_df['selected'] == value].shape[0]
+            count = counts[value]
 
         if relative:
             relative_count = count / total_count * 100
@@ -366,47 +357,48 @@ def barplot(df, id_list, bhvr_list, plot_categories=False, relative=False, plot_
 
     # If relative, plot pie chart
     if relative:
-        plt.pie(pie_values, 
+        ax.pie(pie_values, 
                 labels=[x.split('(')[-2] if float(x.split('(')[-1].split('%')[0]) > 4 else '' for x in pie_labels], 
                 autopct=lambda pct: '%1.2f%%' % pct if pct > 4 else '', 
                 startangle=140, 
                 colors=[color_dict[value] for value in sorted(individual_df['selected'].unique())])          
-        plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-        plt.legend(loc='upper left', labels=pie_labels, bbox_to_anchor=(1, 1), title= "Behavioral categories" if plot_categories else "Behaviors" )
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        ax.legend(loc='upper left', labels=pie_labels, bbox_to_anchor=(1, 1), title= "Behavioral categories" if plot_categories else "Behaviors" )
     # Else, configure bar chart
     else:
         # Set yticks, tetermine y-axis tick frequency based on the maximum value
         max_val = int(ax.get_ylim()[1])
         ytick_frequency = determine_ytick_frequency(max_val)
-        plt.yticks(range(0, max_val + 1, ytick_frequency))
-        plt.grid(axis='y', linestyle="-", linewidth=0.2)
+        ax.set_yticks(range(0, max_val + 1, ytick_frequency))
+        ax.grid(axis='y', linestyle="-", linewidth=0.2)
         # Rotate x-tick labels by 45 degrees
-        plt.xticks(rotation=45, ha='right')
+        for label in ax.get_xticklabels():
+            label.set(rotation=45, ha='right')
         # Add legend and axis labels
-        plt.legend(loc='upper left', bbox_to_anchor=(1, 1), title= "Behavioral categories" if plot_categories else "Behaviors" )
+        ax.legend(loc='upper left', bbox_to_anchor=(1, 1), title= "Behavioral categories" if plot_categories else "Behaviors" )
 
     if relative and not plot_total_time:
-        plt.title("Relative count of behaviors" if plot_categories else "Relative count of behaviors", fontsize=18)
+        ax.set_title("Relative count of behaviors" if plot_categories else "Relative count of behaviors", fontsize=18)
     if (not relative) and (not plot_total_time):
-        plt.ylabel("Count", fontsize=16, labelpad=10)
-        plt.title("Total count of behavioral categories" if plot_categories else "Total count of behaviors", fontsize=18)
+        ax.set_ylabel("Count", fontsize=16, labelpad=10)
+        ax.set_title("Total count of behavioral categories" if plot_categories else "Total count of behaviors", fontsize=18)
     if not relative and plot_total_time:
-        plt.title("Total duration of behavioral categories" if plot_categories else "Total duration of behaviors", fontsize=18)
-        plt.ylabel("Duration (s)", fontsize=16, labelpad=10)
+        ax.set_title("Total duration of behavioral categories" if plot_categories else "Total duration of behaviors", fontsize=18)
+        ax.set_ylabel("Duration (s)", fontsize=16, labelpad=10)
     if relative and plot_total_time:
-        plt.title("Relative duration of behavioral categories" if plot_categories else "Relative duration of behavioral categories", fontsize=18)
+        ax.set_title("Relative duration of behavioral categories" if plot_categories else "Relative duration of behavioral categories", fontsize=18)
 
     # save image
-    path = "public/barplots/barplot-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
-    plt.close(fig)
+    if path is None:
+        path = "public/barplots/barplot-" + uuid.uuid4().hex + ".svg"
+    save_figure(fig, path)
 
     # return url where image resides
     url = localhost + path
 
     return url
 
-def time_series(df,subject_id, bhvr_list, plot_categories):
+def time_series(df,subject_id, bhvr_list, plot_categories, bouts=None, path=None):
     
     bhvr_list = sorted(bhvr_list)
     df_copy = df.copy()
@@ -422,44 +414,26 @@ def time_series(df,subject_id, bhvr_list, plot_categories):
         df['selected'] = df['behavior'].copy()
         color_dict = map_values_to_color(df,False)
 
-    # Filter dataframe to include only the specified behaviors
-    df = df[df['subject'] == subject_id]
-    df = df[df['selected'].isin(bhvr_list)]
+    # Only bouts of state behaviors of the subject, point events have no extent on the time axis
+    if bouts is None:
+        bouts = build_bouts(df)
+    bouts["selected"] = bouts["behavioral_category" if plot_categories else "behavior"]
+    bouts = bouts[(bouts.subject == subject_id) & (bouts.stop > bouts.start)]
     
     # Create a figure and axis object with a wider size and fixed aspect ratio
-    plt.close("all")
-    fig = plt.figure(2, figsize=(15,5))
+    fig = Figure(figsize=(15,5))
     ax = fig.subplots()
     ax.set_aspect(30) 
     
     # Create a dictionary to map behavior names to their corresponding positions
     behavior_positions = {bhvr: i for i, bhvr in enumerate(bhvr_list)}
 
-    # Iterate over each behavior
+    # Plot a horizontal line for each bout of a behavior
     for behavior in bhvr_list:
-        # Filter dataframe for the specific behavior
-        behavior_df = df[df['selected'] == behavior]
-
-        # Initialize start time
-        start_time = None
-
-        # Initialize flag to check if the behavior is shown
-        behavior_shown = False
-
-        # Iterate over each row in the filtered dataframe
-        for index, row in behavior_df.iterrows():
-            # Get the start and stop times for the behavior
-            if row['status'] == 'START' and not behavior_shown:
-                start_time = row['time']
-                behavior_shown = True
-                shown_behavior = row['behavior']
-            elif row['status'] == 'STOP' and row['behavior'] == shown_behavior:
-                stop_time = row['time']
-                if behavior_shown:
-                    # Plot a horizontal line for the behavior
-                    ax.hlines(behavior_positions[behavior], start_time, stop_time, color=color_dict[row.selected], linewidth=15)
-                behavior_shown = False
-                start_time = None  # Reset start time after plotting
+        behavior_bouts = bouts[bouts.selected == behavior]
+        if len(behavior_bouts):
+            y = np.full(len(behavior_bouts), behavior_positions[behavior])
+            ax.hlines(y, behavior_bouts.start, behavior_bouts.stop, color=color_dict[behavior], linewidth=15)
 
 
     # Plot thin grey horizontal lines at each ytick position
@@ -489,9 +463,9 @@ def time_series(df,subject_id, bhvr_list, plot_categories):
     ax.set_title(f"Time budget chart for subject {subject_id}", fontsize=18)
     
     # save image
-    path = "public/timeseries/timeseries-" + uuid.uuid4().hex + ".svg"
-    plt.savefig(path, format="svg", bbox_inches="tight")
-    plt.close(fig)
+    if path is None:
+        path = "public/timeseries/timeseries-" + uuid.uuid4().hex + ".svg"
+    save_figure(fig, path)
 
     # return url where image resides
     url = localhost + path
@@ -500,6 +474,114 @@ def time_series(df,subject_id, bhvr_list, plot_categories):
 
 
 
+def transition_tables(
+    df,
+    option,
+    min_edge_count,
+    normalized,
+    id_list,
+    bhvr_list,
+    bouts=None,
+    order=1,
+    normalization_mode="row",
+    permutations=0,
+    random_state=DEFAULT_SEED,
+):
+    """
+    Counts the transitions and node statistics a transition network is drawn from, without any rendering.
+
+    :param df: The dataframe containing the behavior data
+    :param option: either behavior or behavioral_category
+    :param min_edge_count: Threshold for edges to be kept
+    :param normalized: add the transitional frequencies in column normalized
+    :param id_list: list of selected subjects
+    :param bhvr_list: list of selected behavioral events
+    :param bouts: bout table of df, built from df if not given
+    :param order: number of behaviors per node
+    :param normalization_mode: frequencies relative to all transitions from the same behavior (row),
+        to the same behavior (column) or to all transitions (global)
+    :param permutations: number of shuffled sequences to test the transitions against, 0 for no test (only for order 1)
+    :param random_state: seed of the permutations, None for random permutations
+    :return: 2-tuple (edges_df with columns action_1, status_1, action_2, status_2, tuples, records and optionally normalized
+        as well as transitions, expected, z_score and p_value of the permutation test,
+        nodes_df with columns node, total_time, category, record, avg_time)
+    """
+    local_df = df
+    data = option
+    min_count = min_edge_count
+
+    # Hacky solution: if frontend has not yet initialized the id_list, then use all IDs
+    if "dummy" in id_list:
+        id_list = get_fish_ids(df)
+
+    # Set user chosen column
+    if data == "behavioral_category":
+        # reset list of removed behaviors
+        local_df["chosen_data"] = local_df["behavioral_category"]
+    else:
+        # reset list of removed behavioral categories
+        local_df["chosen_data"] = local_df["behavior"]
+
+    # Remove behaviors/categories that are unselected by the user
+    if "dummy" not in bhvr_list:
+        # Filter rows based on selected behaviors
+        local_df = local_df[local_df.chosen_data.isin(bhvr_list)]
+
+    # lets make an edgelist with behavior and successor
+    successor_df = count_transitions(local_df, id_list, "chosen_data", order)
+
+    # normalize the records in [0,1] so that all together are 1 for each action (or target, or overall)
+    edges_df = successor_df
+    if normalized:
+        # unrounded, thresholds and edge widths also work for the small frequencies of the global mode
+        edges_df["normalized"] = transition_frequencies(edges_df, normalization_mode)
+
+    # compare the transitions (of any status) with sequences shuffled within each subject
+    if permutations and order == 1:
+        significance = permutation_test(local_df, id_list, "chosen_data", permutations, random_state)
+        significance = significance.rename(columns={"records": "transitions"})
+        edges_df = pd.merge(edges_df, significance, on=["action_1", "action_2"], how="left")
+
+    # erase edges below min_count
+    edges_df = threshold_edges(edges_df, min_count, normalized)
+
+    # add average and total time
+    if bouts is None:
+        bouts = build_bouts(df)
+    if "dummy" not in bhvr_list:
+        bouts = bouts[bouts[data].isin(bhvr_list)]
+    times_df = get_behavior_times(bouts, id_list, data).rename(columns={data: "action_1"})
+    times_df = times_df[["action_1", "total_time", "category"]]
+    if order > 1:
+        # sequence nodes show the time and category of their most recent behavior
+        states = pd.unique(pd.concat([successor_df.action_1, successor_df.action_2]))
+        states_df = pd.DataFrame({"action_1": states, "last": [state.split(STATE_SEPARATOR)[-1] for state in states]})
+        times_df = pd.merge(states_df, times_df.rename(columns={"action_1": "last"}), on="last", how="left")
+        times_df = times_df[["action_1", "total_time", "category"]]
+
+    # work on the nodes(behaviors) of the graph so we can later set node-attributes for graphviz
+    nodes_df = edges_df[["action_1", "records"]]
+    nodes_df = (
+        edges_df.groupby("action_1")["records"]
+        .sum()
+        .to_frame(name="records")
+        .reset_index()
+    )
+
+    nodes_df = pd.merge(times_df, nodes_df, on="action_1", how="outer")
+    nodes_df.columns = ["node", "total_time", "category", "record"]
+    # Assuming nodes_df is your DataFrame
+    nodes_df["avg_time"] = np.where((nodes_df["record"] == 0) | (nodes_df["total_time"].isna()) | (nodes_df["record"].isna()),0,nodes_df["total_time"] / nodes_df["record"])
+    # if a behavior occurs only once/ as last behavior maybe of an animal it is not counted
+
+    nodes_df.record = nodes_df.record.fillna(1).astype(int)
+    # round results
+    nodes_df.total_time = nodes_df.total_time.round(2)
+    nodes_df.avg_time = nodes_df.avg_time.round(2)
+
+    return edges_df, nodes_df
+
+
 def transition_network(
     df,
     option,
@@ -516,7 +598,17 @@ def transition_network(
     bhvr_list,
     custom_edge_thickness,
     logarithmic_normalization,
-    for_comparison
+    for_comparison,
+    bouts=None,
+    order=1,
+    normalization_mode="row",
+    permutations=0,
+    random_state=DEFAULT_SEED,
+    tables=None,
+    path=None,
+    output="image",
+    coordinates=False,
+    category_colors=None,
 ):
     """
     The behavior transition network displays temporal sequences of behavioral events.
@@ -547,13 +639,24 @@ def transition_network(
     :param bhvr: list of selected behavioral events
     :param custom_edge_thickness:
     :param logarithmic_normalization: Normalize logarithmically instead of linearly
-
-    :return: url where svg image of graph is saved
+    :param bouts: bout table of df, built from df if not given
+    :param order: number of behaviors per node, nodes of higher order networks are sequences like "A → B"
+    :param normalization_mode: row, column or global, see transition_tables
+    :param permutations: number of shuffled sequences to test the transitions against, 0 for no test.
+        P-values and z-scores are added as edge attributes and saved in a separate edge statistics csv
+    :param random_state: seed of the permutations, None for random permutations
+    :param tables: edge and node tables counted before, see transition_tables, counted from df if not given
+    :param path: location of the saved files without extension, a new random name if not given
+    :param output: "image" renders and saves the network, "json" returns it without writing any file
+    :param coordinates: add graphviz node and edge positions to the json output
+    :param category_colors: colors of the behavioral categories, see helpers.map_values_to_color, taken from df if not given.
+        df is not needed if tables and category_colors are given
+
+    :return: url where svg image of graph is saved, or the network as dict, see rendering.graph_json
 
     """
 
     # Set user specified params
-    local_df = df
     # Behavior/Behavioral category
     data = option
     # Edge thickness
@@ -570,106 +673,14 @@ def transition_network(
     node_label = node_label_map
     
     # category dependent coloring
-    category_color_dict = map_values_to_color(df, True)
-
-    # Hacky solution: if frontend has not yet initialized the id_list, then use all IDs
-    if "dummy" in id_list:
-        id_list = get_fish_ids(df)
-
-    # Set user chosen column
-    if data == "behavioral_category":
-        # reset list of removed behaviors
-        local_df["chosen_data"] = local_df["behavioral_category"]
-    else:
-        # reset list of removed behavioral categories
-        local_df["chosen_data"] = local_df["behavior"]
-
-    successor_list = []
-    
-    # Remove behaviors/categories that are unselected by the user
-    if "dummy" not in bhvr_list:
-        # Filter rows based on selected behaviors
-        local_df = local_df[local_df.chosen_data.isin(bhvr_list)]
-
-    # Loop through dataframe for each fish and add behavior and successor
-    for fish in id_list:
-        id_frame = local_df[local_df.subject == fish]
-        id_frame = id_frame.drop(id_frame[id_frame.status == "STOP"].index)
-        i = 0
-        k = i + 1
-        while i < len(id_frame) - 1:
-            successor_list.append(
-                (
-                    id_frame.chosen_data.iloc[i],
-                    id_frame.status.iloc[i],
-                    id_frame.chosen_data.iloc[k],
-                    id_frame.status.iloc[k],
-                )
-            )
-            k += 1
-            i += 1
-
-    # lets make an edgelist with behavior and successor
-    successor_df = pd.DataFrame(
-        successor_list, columns=["action_1", "status_1", "action_2", "status_2"]
-    )
-    successor_df = successor_df.replace(to_replace="POINT", value="")
-
-    successor_df["tuples"] = list(zip(successor_df.action_1, successor_df.action_2))
-    successor_df = (
-        successor_df.groupby(successor_df.columns.tolist())
-        .size()
-        .to_frame(name="records")
-        .reset_index()
-    )
-
-    # normalize the records in [0,1] so that all together are 1 for each action
-    behavior_ids = successor_df.action_1.unique().tolist()
-    edges_df = pd.DataFrame()
-    for action in behavior_ids:
-        action_frame = successor_df[successor_df.action_1 == action]
-        if normalized:
-            sum_of_successors = action_frame.records.sum()
-            action_frame["normalized"] = action_frame.records.div(
-                sum_of_successors
-            ).round(2)
-            # action_frame['ln_normalized'] = (np.log(action_frame.records) / np.log(sum_of_successors)).round(2)
-        edges_df = edges_df.append(action_frame)
+    category_color_dict = category_colors if category_colors is not None else map_values_to_color(df, True)
 
-    # erase edges below min_count
-    try:
-        if normalized and min_count:
-            edges_df = edges_df[edges_df.normalized >= float(min_count)]
-        elif not normalized and min_count:
-            edges_df = edges_df[edges_df.records >= float(min_count)]
-    except:
-        pass
-
-
-    # add average and total time
-    times_list = get_total_time_and_category(local_df, id_list)
-    times_df = pd.DataFrame(times_list, columns=["action_1", "total_time", "category"])
-
-    # work on the nodes(behaviors) of the graph so we can later set node-attributes for graphviz
-    nodes_df = edges_df[["action_1", "records"]]
-    nodes_df = (
-        edges_df.groupby("action_1")["records"]
-        .sum()
-        .to_frame(name="records")
-        .reset_index()
-    )
-
-    nodes_df = pd.merge(times_df, nodes_df, on="action_1", how="outer")
-    nodes_df.columns = ["node", "total_time", "category", "record"]
-    # Assuming nodes_df is your DataFrame
-    nodes_df["avg_time"] = np.where((nodes_df["record"] == 0) | (nodes_df["total_time"].isna()) | (nodes_df["record"].isna()),0,nodes_df["total_time"] / nodes_df["record"])
-    # if a behavior occurs only once/ as last behavior maybe of an animal it is not counted
-
-    nodes_df.record = nodes_df.record.fillna(1).astype(int)
-    # round results
-    nodes_df.total_time = nodes_df.total_time.round(2)
-    nodes_df.avg_time = nodes_df.avg_time.round(2)
-    
+    # count transitions and node statistics
+    if tables is None:
+        tables = transition_tables(
+            df, data, min_count, normalized, id_list, bhvr_list, bouts, order, normalization_mode, permutations, random_state
+        )
+    edges_df, nodes_df = tables
 
     # Change node label if user maps total/avg time or record to node label
     labels_1 = nodes_df.copy()
@@ -710,6 +721,17 @@ def transition_network(
 
     # Save dataframe with absolute (non-normalized) values
     save_nodes_df = nodes_df.copy()
+    if "p_value" in edges_df.columns:
+        edge_statistics = pd.DataFrame(
+            {
+                "Source": edges_df.action_1,
+                "Target": edges_df.action_2,
+                "#Transitions": edges_df.transitions,
+                "Expected": edges_df.expected.round(2),
+                "Z-Score": edges_df.z_score.round(2),
+                "P-Value": edges_df.p_value.round(4),
+            }
+        ).drop_duplicates(["Source", "Target"])
 
     # logarithmic max-min normalization of record, avg_time and total_time
     if logarithmic_normalization:
@@ -777,9 +799,16 @@ def transition_network(
 
     # create label and weight for edges
     if normalized:
-        edge_attributes_label = dict(zip(edges_df.tuples, edges_df.normalized))
+        # only the labels are rounded, global frequencies as percentages since they are mostly below 0.01
+        if normalization_mode == "global":
+            edge_attributes_label = dict(zip(edges_df.tuples, (edges_df.normalized * 100).map("{:.2f}%".format)))
+            # widths relative to the most frequent transition, the frequencies of all edges sum up to 1
+            edge_width = edges_df.normalized / edges_df.normalized.max()
+        else:
+            edge_attributes_label = dict(zip(edges_df.tuples, edges_df.normalized.round(2)))
+            edge_width = edges_df.normalized
         edge_attributes_weight = dict(
-            zip(edges_df.tuples, edges_df.normalized * multiplication_factor)
+            zip(edges_df.tuples, edge_width * multiplication_factor)
         )
         # if (logarithmic_normalization):
         #    edge_attributes_weight = dict(zip(edges_df.tuples, edges_df.normalized * multiplication_factor))
@@ -818,7 +847,12 @@ def transition_network(
         # print(edge_attributes_weight)
     nx.set_edge_attributes(G, edge_attributes_label, name="label")
     if (for_comparison):
-        nx.set_edge_attributes(G, edge_attributes_label, name="weight")
+        # unrounded frequencies, or the counts
+        edge_weights = dict(zip(edges_df.tuples, edges_df.normalized)) if normalized else edge_attributes_label
+        nx.set_edge_attributes(G, edge_weights, name="weight")
+    if "p_value" in edges_df.columns:
+        nx.set_edge_attributes(G, dict(zip(edges_df.tuples, edges_df.p_value)), name="p_value")
+        nx.set_edge_attributes(G, dict(zip(edges_df.tuples, edges_df.z_score)), name="z_score")
 
     # set node attributes
     if not colored and node_colour in ['amount', 'total_time', 'avg_time']:
@@ -849,46 +883,19 @@ def transition_network(
     # add avg time as node attribute
     nx.set_node_attributes(G, nodes_attributes_avg_time, name="avg_time")
 
-    # Create a DataFrame with ingoing and outgoing edges count and sum of edge labels for each ID
-    node_data = []
-    for node in G.nodes:
-        ingoing_edges = G.in_edges(node, data=True)
-        outgoing_edges = G.out_edges(node, data=True)
-
-        ingoing_count = len(ingoing_edges)
-        outgoing_count = len(outgoing_edges)
-        ingoing_label_sum = sum(edge[2]['label'] for edge in ingoing_edges )
-        outgoing_label_sum = sum(edge[2]['label'] for edge in outgoing_edges )
-
-        # Calculate records, average_time and total_time 
-        mask = save_nodes_df['node'] == node
-        avg_time_value = save_nodes_df.loc[mask, 'avg_time'].values[0] if any(mask) else np.nan
-        total_time_value = save_nodes_df.loc[mask, 'total_time'].values[0] if any(mask) else np.nan
-        record_value = save_nodes_df.loc[mask, 'record'].values[0] if any(mask) else np.nan
-
-        # Calculate centrality measures
-        in_centrality = nx.in_degree_centrality(G).get(node, 0)
-        out_centrality = nx.out_degree_centrality(G).get(node, 0)
-
-        # Calculate additional centrality measures
-        closeness_centrality = nx.closeness_centrality(G).get(node, 0)
-        betweenness_centrality = nx.betweenness_centrality(G).get(node, 0)
-
-
-        node_data.append({
-            'ID': node,
-            'AverageTime': avg_time_value,
-            'TotalTime': total_time_value,
-            '#Occurences': record_value,
-            '#IngoingEdges': ingoing_count,
-            '#OutgoingEdges': outgoing_count,
-            'In-Deg.Cen.': in_centrality,
-            'Out-Deg.Cen.': out_centrality,
-            'Closen.Cen.': closeness_centrality,
-            'Between.Cen.': betweenness_centrality,
-        })
-
-    statistics_df = pd.DataFrame(node_data)
+    # Create a DataFrame with time, occurrences, edge counts and centralities for each ID
+    node_values = save_nodes_df.drop_duplicates("node").set_index("node")
+    statistics_df = pd.DataFrame({"ID": list(G.nodes)})
+    statistics_df["AverageTime"] = statistics_df.ID.map(node_values.avg_time)
+    statistics_df["TotalTime"] = statistics_df.ID.map(node_values.total_time)
+    statistics_df["#Occurences"] = statistics_df.ID.map(node_values.record)
+    statistics_df["#IngoingEdges"] = [G.in_degree(node) for node in G.nodes]
+    statistics_df["#OutgoingEdges"] = [G.out_degree(node) for node in G.nodes]
+    # each centrality once for the whole graph. Networks for comparison are only read as gml and have no
+    # statistics table, so they only need the centralities mapped to their nodes
+    statistics = not for_comparison
+    metrics = needed_centralities([node_size] if colored else [node_size, node_colour], statistics)
+    statistics_df = statistics_df.merge(centrality_table(G, metrics), on="ID", how="left")
     # Sort the DataFrame alphanumerically by the 'ID' column
     statistics_sorted = statistics_df.sort_values(by='ID', key=lambda x: x.map(alphanum_key))
 
@@ -926,23 +933,67 @@ def transition_network(
     nx.set_node_attributes(G, nodes_width, name="width")
     nx.set_node_attributes(G, nodes_height, name="height")
 
-    # graphviz
-    G_dot_string = to_pydot(G).to_string()
-    G_dot = graphviz.Source(G_dot_string)
-    G_dot.format = "svg"
+    # the client renders the network itself, p-values and z-scores are part of the edge attributes
+    if output == "json":
+        return graph_json(G, coordinates, statistics_sorted if statistics else None)
 
-    # save image
-    path = "public/transitions/transitions-" + uuid.uuid4().hex
-    G_dot.render(path + ".gv", view=False)
+    # save graphviz source and image
+    if path is None:
+        path = "public/transitions/transitions-" + uuid.uuid4().hex
+    render_graph(G, path)
     # save graph as .gml
     nx.write_gml(G, path + ".gml")
 
     # Save the DataFrame to CSV
-    statistics_sorted.to_csv( path + "-statistics.csv", index=False)
+    if statistics:
+        statistics_sorted.to_csv(path + "-statistics.csv", index=False)
+    if "p_value" in edges_df.columns:
+        edge_statistics = edge_statistics.sort_values(by="Source", key=lambda x: x.map(alphanum_key), kind="stable")
+        edge_statistics.to_csv(path + "-edge-statistics.csv", index=False)
     
     # return url where images is saved
     #playground
     #url =  path + ".gv.svg"
     url = localhost + path + ".gv.svg"
     
-    return url
\ No newline at end of file
+    return url
+
+def transition_frames(windows, color_hue=150, colored_edge_thickness=2, path=None):
+    """
+    Renders the transition counts of sliding time windows as one network per window. All frames
+    share the same nodes and edge widths are relative to the largest count of any window, so frames can be compared.
+
+    :param windows: dict of numpy arrays, see transitions.windowed_transitions
+    :param color_hue: value on the color cycle
+    :param colored_edge_thickness: width of the edge with the largest count
+    :param path: location of the frames without frame number and extension, a new random name if not given
+    :return: list of urls where the svg images of the frames are saved, in order of rendering
+    """
+    labels = windows["labels"]
+    counts = windows["counts"]
+    # behaviors that occur in any window
+    nodes = labels[(counts.sum(axis=(0, 2)) + counts.sum(axis=(0, 1))) > 0]
+    max_count = max(counts.max(initial=0), 1)
+    fillcolor = str(color_hue / 360) + " 0.5 1"
+
+    if path is None:
+        path = "public/transitions/transitions-" + uuid.uuid4().hex
+    urls = []
+    for i, (start, frame) in enumerate(zip(windows["starts"], counts)):
+        G = nx.DiGraph()
+        G.add_nodes_from(nodes, style="filled", fillcolor=fillcolor)
+        for row, col in zip(*np.nonzero(frame)):
+            G.add_edge(
+                labels[row],
+                labels[col],
+                label=int(frame[row, col]),
+                penwidth=max(0.2, colored_edge_thickness * frame[row, col] / max_count),
+            )
+        # show the start of the window as graph label
+        G.graph["graph"] = {"label": "{:.1f} s".format(start), "labelloc": "t"}
+
+        frame_path = path + "-frame-" + str(i)
+        render_graph(G, frame_path)
+        urls.append(localhost + frame_path + ".gv.svg")
+
+    return urls
@@ -99,6 +99,12 @@ export default function Transitions(props) {
     saveAs(url, props.upload_name.split(' ').join('_') + "_interactions_statistics");
   }
 
+  // export p-values and z-scores of the edges
+  const downloadEdgeStatistics = () => {
+    let url = props.graph.slice(0, -7) + "-edge-statistics.csv"
+    saveAs(url, props.upload_name.split(' ').join('_') + "_transitions_edge_statistics");
+  }
+
   return (
     <div className="padded">
       <div className="text">
@@ -159,6 +165,7 @@ export default function Transitions(props) {
                   props.passValues({ normalized: checked, })
                   //reset the min_edge_count as the slider ranges differ
                   props.passValues({ min_edge_count: 0 })
+                  props.passValues({ normalization_mode: "row" })
                   props.passValues({ transitions_new_config: true, })
                 }}
               />
@@ -179,6 +186,25 @@ export default function Transitions(props) {
             />
           </div> */}
 
+            {/*switch for the permutation test of the edges, only tested for one behavior per node*/}
+            {Number(props.order) === 1 && (
+              <div className="margin-switches">
+                <span><b>Edge significance:</b>&nbsp;&nbsp;&nbsp;</span>
+                <BootstrapSwitchButton
+                  checked={props.permutations > 0}
+                  onlabel='Permutation test (1000 shuffles)'
+                  offlabel='None'
+                  offstyle="primary"
+                  onstyle="primary"
+                  width="300"
+                  onChange={(checked) => {
+                    props.passValues({ permutations: checked ? 1000 : 0 })
+                    props.passValues({ transitions_new_config: true, })
+                  }}
+                />
+              </div>
+            )}
+
             {/*switch for color type*/}
             <div className="margin-switches">
               <span><b>Color setting:</b>&nbsp;&nbsp;&nbsp;</span>
@@ -237,7 +263,7 @@ export default function Transitions(props) {
                   type="number"
                   min="0"
                   max="1"
-                  step="0.01"
+                  step="0.001"
                   placeholder="0"
                   onChange={handleChange}
                   onWheel={(e) => e.target.blur()}
@@ -258,6 +284,38 @@ export default function Transitions(props) {
                 ></input>
               )}
             </div>
+            {props.normalized && (
+              <div className="mappings">
+                <span><b>Frequencies relative to:</b>&nbsp;&nbsp;&nbsp;</span>
+                <select
+                  className="form-select"
+                  name="normalization_mode"
+                  id="normalization_mode"
+                  value={props.normalization_mode}
+                  onChange={handleChange}
+                  style={{ width: '200px' }}
+                >
+                  <option value="row">Source behavior</option>
+                  <option value="column">Target behavior</option>
+                  <option value="global">All transitions</option>
+                </select>
+              </div>
+            )}
+            <div className="mappings">
+              <span><b>Behaviors per node:</b>&nbsp;&nbsp;&nbsp;</span>
+              <select
+                className="form-select"
+                name="order"
+                id="order"
+                value={props.order}
+                onChange={handleChange}
+                style={{ width: '200px' }}
+              >
+                <option value="1">1 (A)</option>
+                <option value="2">2 (A → B)</option>
+                <option value="3">3 (A → B → C)</option>
+              </select>
+            </div>
 
           </div>
           <div className="right-panel">
@@ -448,6 +506,7 @@ export default function Transitions(props) {
             <button type="button" className="btn btn-link custom-btn" onClick={downloadSVG}>{" "}{"\u21E9 export Image (.svg)"}{" "}</button>
             <button type="button" className="btn btn-link custom-btn" onClick={downloadGV}>{" "}{"\u21E9 export Graphviz (.gv)"}{" "}</button>
             <button type="button" className="btn btn-link custom-btn" onClick={downloadStatistics}>{" "}{"\u21E9 export statistics (.csv)"}{" "}</button>
+            {props.permutations > 0 && Number(props.order) === 1 && (<button type="button" className="btn btn-link custom-btn" onClick={downloadEdgeStatistics}>{" "}{"\u21E9 export edge statistics (.csv)"}{" "}</button>)}
           </div>
           {props.graph && (<CsvTable graph={props.graph.slice(0, -7) + "-statistics.csv"} />)}
         </div>
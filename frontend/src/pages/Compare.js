@@ -19,6 +19,8 @@ export default class Compare extends Component {
       upload_successful: null,
       upload_response: null,
       upload_name: null,
+      // id of the stored dataset, sent instead of the file after validation
+      dataset: null,
       // arrayS with the names of all network images, the edge lists are retrivable from the server with the name
       groupA: [],
       groupB: [],
@@ -42,8 +44,11 @@ export default class Compare extends Component {
       [Object.keys(obj)[0]]: obj[Object.keys(obj)[0]],
     }, () => {
       // validate upload and calculate behavior transition network with standard settings
-      trackPromise(this.validateUpload())
-      trackPromise(this.getTransitions());
+      trackPromise(this.validateUpload().then(() => {
+        if (this.state.upload_successful) {
+          return this.getTransitions();
+        }
+      }));
     });
   };
 
@@ -67,6 +72,7 @@ export default class Compare extends Component {
         this.setState({
           upload_successful: data.success,
           upload_response: data.response,
+          dataset: data.dataset,
         })
       )
   };
@@ -77,7 +83,7 @@ export default class Compare extends Component {
 
   getTransitions = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     formData.append("option", this.state["option"]);
     formData.append("normalized", this.state["normalized"]);
     formData.append("for_comparison", true);
@@ -25,6 +25,8 @@ export default class Generate extends Component {
       upload_successful: null,
       upload_response: null,
       upload_name: null,
+      // id of the stored dataset, sent instead of the file after validation
+      dataset: null,
       //general information on uploaded dataset
       headers: null,
       //dummys needed for first render when no input is provided
@@ -83,6 +85,9 @@ export default class Generate extends Component {
       t_bhvr_list: ['dummy'],
       t_cat_list: ['dummy'],
       custom_edge_thickness: false,
+      order: 1,
+      normalization_mode: "row",
+      permutations: 0,
       // For All charts/networks
       request_new_plot: true,
       plot_new_config: false,
@@ -110,8 +115,11 @@ export default class Generate extends Component {
     formData.append("node_color_map", this.state["node_color_map"]);
     formData.append("node_size_map", this.state["node_size_map"]);
     formData.append("node_label_map", this.state["node_label_map"]);
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     formData.append("logarithmic_normalization", this.state["logarithmic_normalization"]);
+    formData.append("order", this.state["order"]);
+    formData.append("normalization_mode", this.state["normalization_mode"]);
+    formData.append("permutations", this.state["permutations"]);
     // Selection of IDs
     formData.append("id_list", JSON.stringify(this.state.t_id_list));
     // Selection of behaviors/categories
@@ -131,7 +139,7 @@ export default class Generate extends Component {
 
   getInteractions = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     // Selection of IDs
     formData.append("id_list", JSON.stringify(this.state.i_id_list));
     formData.append("mod1_list", JSON.stringify(this.state.i_mod1_list));
@@ -150,7 +158,7 @@ export default class Generate extends Component {
 
   getBehaviorPlot = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     formData.append("plot_categories", this.state.plot_categories);
     formData.append("separate", this.state.separate);
     // Selection of IDs
@@ -171,7 +179,7 @@ export default class Generate extends Component {
 
   getBarplot = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     formData.append("plot_categories", this.state.barplot_plot_categories);
     formData.append("plot_total_time", this.state.barplot_plot_total_time);
     formData.append("relative", this.state.barplot_relative);
@@ -193,7 +201,7 @@ export default class Generate extends Component {
 
   getTimeSeries = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
     formData.append("plot_categories", this.state.timeseries_plot_categories);
     // Selection of IDs
     formData.append("id_list", JSON.stringify(this.state.timeseries_id_list));
@@ -218,7 +226,7 @@ export default class Generate extends Component {
    */
   getInfo = async () => {
     const formData = new FormData();
-    formData.append("upload", this.state["upload"]);
+    formData.append("dataset", this.state["dataset"]);
 
     await fetch(url + "api/infos/", {
       method: "POST",
@@ -268,6 +276,7 @@ export default class Generate extends Component {
         this.setState({
           upload_successful: data.success,
           upload_response: data.response,
+          dataset: data.dataset,
         })
       )
   };
@@ -334,6 +343,9 @@ export default class Generate extends Component {
       t_bhvr_list: ['dummy'],
       t_cat_list: ['dummy'],
       custom_edge_thickness: false,
+      order: 1,
+      normalization_mode: "row",
+      permutations: 0,
       request_new_plot: true,
       plot_new_config: false,
       request_new_interactions: true,
@@ -342,14 +354,21 @@ export default class Generate extends Component {
       transitions_new_config: false,
       logarithmic_normalization: false,
     }, () => {
-      trackPromise(this.validateUpload());
-      trackPromise(this.getInfo());
-      trackPromise(this.getTransitions())
-      trackPromise(this.getInteractions());
-      trackPromise(this.getBarplot()).then(() => this.getBehaviorPlot()).then(() => this.getTimeSeries())
+      trackPromise(this.validateUpload().then(() => this.requestAll()));
     });
   };
 
+  // fetches all outputs once the upload has been stored and its id is known
+  requestAll = () => {
+    if (!this.state.upload_successful) {
+      return;
+    }
+    trackPromise(this.getInfo());
+    trackPromise(this.getTransitions());
+    trackPromise(this.getInteractions());
+    trackPromise(this.getBarplot()).then(() => this.getBehaviorPlot()).then(() => this.getTimeSeries())
+  };
+
   // updates all state vars related to behavior plot
   updatePlot = (obj) => {
     this.setState({ [Object.keys(obj)[0]]: obj[Object.keys(obj)[0]] }, () => {
@@ -482,6 +501,9 @@ export default class Generate extends Component {
       t_bhvr_list: ['dummy'],
       t_cat_list: ['dummy'],
       custom_edge_thickness: false,
+      order: 1,
+      normalization_mode: "row",
+      permutations: 0,
       request_new_plot: true,
       plot_new_config: false,
       request_new_interactions: true,
@@ -491,11 +513,7 @@ export default class Generate extends Component {
       logarithmic_normalization: false,
     }, () => {
       // First reset all output diagrams and their parametrization
-      trackPromise(this.validateUpload());
-      trackPromise(this.getInfo());
-      trackPromise(this.getTransitions());
-      trackPromise(this.getInteractions());
-      trackPromise(this.getBarplot()).then(() => this.getBehaviorPlot()).then(() => this.getTimeSeries())
+      trackPromise(this.validateUpload().then(() => this.requestAll()));
     });
   };
 
@@ -615,6 +633,9 @@ export default class Generate extends Component {
             passValues={this.updateTransitionNetwork}
             graph={this.state.graph}
             normalized={this.state.normalized}
+            normalization_mode={this.state.normalization_mode}
+            permutations={this.state.permutations}
+            order={this.state.order}
             colored={this.state.colored}
             option={this.state.option}
             with_status={this.state.with_status}